@@ -0,0 +1,50 @@
+"""搜索结果解析微基准：split_entry_list / parse_upload_date 对比 ast.literal_eval / strptime
+
+运行：python benchmarks/bench_parsing.py （在 misaka改进版 目录下）
+"""
+import ast
+import os
+import sys
+import timeit
+from datetime import datetime
+
+for _name, _value in {
+    "TELEGRAM_TOKEN": "123:bench", "ALIST_BASE_URL": "http://127.0.0.1:5244/", "ALIST_USERNAME": "bench",
+    "ALIST_PASSWORD": "bench", "ALIST_OFFLINE_DIR": "/bench", "JAV_SEARCH_API": "http://127.0.0.1/api/",
+    "ALLOWED_USER_IDS": "1",
+}.items():
+    os.environ.setdefault(_name, _value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tgbot  # noqa: E402
+
+ENTRY = ("['magnet:?xt=urn:btih:0123456789abcdef0123456789abcdef01234567&dn=ABC-001', "
+         "'ABC-001 中文字幕 1080p', '5.40GB', '2024-01-02']")
+DATE = "2024-01-02"
+
+
+def report(label: str, func, number: int) -> float:
+    best = min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+    print(f"{label:<36} {best:8.2f} us")
+    return best
+
+
+def main() -> None:
+    assert tgbot.split_entry_list(ENTRY) == ast.literal_eval(ENTRY)
+    number = 20000
+    print("单条列表解析")
+    fast = report("split_entry_list", lambda: tgbot.split_entry_list(ENTRY), number)
+    slow = report("ast.literal_eval", lambda: ast.literal_eval(ENTRY), number)
+    print(f"{'加速比':<36} {slow / fast:8.1f} x")
+
+    print("\n日期解析")
+    fast = report("parse_upload_date", lambda: tgbot.parse_upload_date(DATE), number)
+    slow = report("datetime.strptime", lambda: datetime.strptime(DATE, '%Y-%m-%d').date(), number)
+    print(f"{'加速比':<36} {slow / fast:8.1f} x")
+
+    print("\n整条解析（含体积/日期）")
+    report("parse_api_data_entry", lambda: tgbot.parse_api_data_entry(ENTRY), number)
+
+
+if __name__ == "__main__":
+    main()
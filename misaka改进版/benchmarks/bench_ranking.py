@@ -0,0 +1,78 @@
+"""磁力排序基准：rank_entries 对比原先的排序选择，并统计默认权重下与原规则的一致率
+
+运行：python benchmarks/bench_ranking.py （在 misaka改进版 目录下）
+"""
+import os
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+
+for _name, _value in {
+    "TELEGRAM_TOKEN": "123:bench", "ALIST_BASE_URL": "http://127.0.0.1:5244/", "ALIST_USERNAME": "bench",
+    "ALIST_PASSWORD": "bench", "ALIST_OFFLINE_DIR": "/bench", "JAV_SEARCH_API": "http://127.0.0.1/api/",
+    "ALLOWED_USER_IDS": "1",
+}.items():
+    os.environ.setdefault(_name, _value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tgbot  # noqa: E402
+
+GB = 1024 ** 3
+
+
+def legacy_select(parsed_entries: list[dict]) -> dict:
+    """原实现（重构前 get_magnet 中的选择逻辑）"""
+    max_size = max(e["size_bytes"] for e in parsed_entries)
+    hd_threshold = max_size * 0.7
+    selected_cluster = [e for e in parsed_entries if e["size_bytes"] >= hd_threshold] or parsed_entries
+    selected_cluster.sort(key=lambda x: (x["size_bytes"], -(x["date"].toordinal() if x["date"] else 0)))
+    return selected_cluster[0]
+
+
+def random_entries(rng: random.Random, count: int) -> list[dict]:
+    entries = []
+    for _ in range(count):
+        entries.append({
+            "magnet": f"magnet:?xt=urn:btih:{rng.getrandbits(160):040x}",
+            "name": "ABC-001 中文字幕" if rng.random() < 0.2 else "ABC-001",
+            "size_bytes": rng.randint(GB // 2, 8 * GB),
+            "date": None if rng.random() < 0.1 else date(2015, 1, 1) + timedelta(rng.randint(0, 4000)),
+            "seeders": None,
+        })
+    return entries
+
+
+def agreement(lists: int = 3000) -> None:
+    rng = random.Random(3000)
+    mismatches = 0
+    for _ in range(lists):
+        count = rng.randint(1, 30)
+        entries = random_entries(rng, count)
+        # 一部分列表使用离散体积，覆盖同体积与近体积的情况
+        if rng.random() < 0.5:
+            for e in entries:
+                e["size_bytes"] = int(rng.choice((3.9, 5.0, 5.02, 5.4)) * GB)
+        if tgbot.select_entry(entries) is not legacy_select(list(entries)):
+            mismatches += 1
+    print(f"与原规则不一致: {mismatches} / {lists} 个随机列表")
+
+
+def main() -> None:
+    agreement()
+    print(f"\n{'条目数':>8} {'原排序':>10} {'新 top-1':>10} {'新 top-5':>10}  (ms)")
+    rng = random.Random(1)
+    for count in (100, 1000, 10000):
+        entries = random_entries(rng, count)
+        number = max(1, 20000 // count)
+        timings = [
+            min(timeit.repeat(func, number=number, repeat=5)) / number * 1000
+            for func in (lambda: legacy_select(list(entries)),
+                         lambda: tgbot.rank_entries(entries, 1),
+                         lambda: tgbot.rank_entries(entries, 5))
+        ]
+        print(f"{count:>8} " + " ".join(f"{t:>10.3f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
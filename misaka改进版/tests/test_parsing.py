@@ -0,0 +1,135 @@
+"""搜索结果解析测试：split_entry_list 与 ast.literal_eval 的模糊对比，以及日期解析
+
+运行：python -m unittest discover -s tests （在 misaka改进版 目录下）
+"""
+import ast
+import os
+import random
+import sys
+import unittest
+from datetime import datetime
+
+# tgbot 在导入时校验必填配置
+for _name, _value in {
+    "TELEGRAM_TOKEN": "123:test", "ALIST_BASE_URL": "http://127.0.0.1:5244/", "ALIST_USERNAME": "test",
+    "ALIST_PASSWORD": "test", "ALIST_OFFLINE_DIR": "/test", "JAV_SEARCH_API": "http://127.0.0.1/api/",
+    "ALLOWED_USER_IDS": "1",
+}.items():
+    os.environ.setdefault(_name, _value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tgbot  # noqa: E402
+
+FUZZ_ROUNDS = 20000
+# 偏向容易出错的字符：引号、反斜杠、逗号、括号、空白与非 ASCII
+ALPHABET = "ab Z09:?=&-_.,[]'\"\\\t\n中文字幕"
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12)))
+
+
+def random_item(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.7:
+        return repr(random_text(rng))  # 与 Python str() 生成的列表元素一致
+    if kind < 0.8:
+        return '"' + random_text(rng).replace('"', '') + '"'
+    if kind < 0.9:
+        return str(rng.randint(-5, 500))
+    return rng.choice(["None", "True", "1.5", "b'x'", "'a' 'b'", "u'x'", "r'\\d'", ""])
+
+
+def random_entry(rng: random.Random) -> str:
+    if rng.random() < 0.4:
+        # 正常形态：str(list)
+        return str([f"magnet:?xt=urn:btih:{rng.getrandbits(160):040x}", random_text(rng),
+                    f"{rng.uniform(0.1, 20):.2f}GB", f"20{rng.randint(10, 25)}-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}"])
+    separators = [", ", ",", " , ", ",\t", ",,", " "]
+    body = rng.choice(separators).join(random_item(rng) for _ in range(rng.randint(0, 5)))
+    if rng.random() < 0.2:
+        body += ","
+    prefix, suffix = ("[", "]") if rng.random() < 0.9 else rng.choice([("(", ")"), ("[", ""), ("", "]")])
+    return rng.choice(["", " "]) + prefix + rng.choice(["", " "]) + body + rng.choice(["", " "]) + suffix
+
+
+def literal_eval_or_error(entry: str):
+    try:
+        return ast.literal_eval(entry)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        return SyntaxError
+
+
+class SplitEntryListTest(unittest.TestCase):
+    def test_typical_entry(self):
+        entry = "['magnet:?xt=urn:btih:abc', 'ABC-001 中文字幕', '5.40GB', '2024-01-02']"
+        self.assertEqual(tgbot.split_entry_list(entry), ast.literal_eval(entry))
+
+    def test_empty_and_whitespace(self):
+        self.assertEqual(tgbot.split_entry_list("[]"), [])
+        self.assertEqual(tgbot.split_entry_list("[ 'a' , \"b\" ]"), ["a", "b"])
+
+    def test_undecidable_inputs_fall_back(self):
+        for entry in ["['a\\'b']", "['a', 1]", "['a' 'b']", "[b'x']", "('a',)", "['a',, 'b']", "['a\\nb']"]:
+            with self.subTest(entry=entry):
+                self.assertIsNone(tgbot.split_entry_list(entry))
+
+    def test_fuzz_matches_literal_eval(self):
+        """快速路径给出结果时必须与 ast.literal_eval 完全一致；返回 None 时由 literal_eval 兜底"""
+        rng = random.Random(20240102)
+        decided = 0
+        for _ in range(FUZZ_ROUNDS):
+            entry = random_entry(rng)
+            fast = tgbot.split_entry_list(entry)
+            if fast is None:
+                continue
+            decided += 1
+            self.assertEqual(fast, literal_eval_or_error(entry), msg=repr(entry))
+        # 确保模糊输入确实覆盖到了快速路径
+        self.assertGreater(decided, FUZZ_ROUNDS // 4)
+
+    def test_parse_api_data_entry_unchanged(self):
+        entries = [
+            "['magnet:?xt=urn:btih:abc', 'name', '5.40GB', '2024-01-02']",
+            "['magnet:?xt=urn:btih:abc', 'it\\'s', '1.1 MB', '']",
+            "['magnet:?xt=urn:btih:abc', 'name', '5.40GB', '2024-01-02', '12']",
+        ]
+        for entry in entries:
+            with self.subTest(entry=entry):
+                parsed = tgbot.parse_api_data_entry(entry)
+                data = ast.literal_eval(entry)
+                self.assertEqual((parsed["magnet"], parsed["name"], parsed["size_str"], parsed["date_str"]),
+                                 tuple(data[:4]))
+
+
+class ParseUploadDateTest(unittest.TestCase):
+    @staticmethod
+    def strptime_or_error(date_str: str):
+        try:
+            return datetime.strptime(date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return ValueError
+
+    def parse_or_error(self, date_str: str):
+        try:
+            return tgbot.parse_upload_date(date_str)
+        except ValueError:
+            return ValueError
+
+    def test_cases(self):
+        cases = ["2024-01-02", "2024-1-2", "2024-02-30", "2023-02-29", "2024-02-29", "0001-01-01",
+                 "9999-12-31", "2024-13-01", "2024-00-10", "24-01-02", "2024/01/02", "2024-01-02 ",
+                 " 2024-01-02", "2024-01-0x", "20240102", "2024-W01-1", "２０２４-01-02", "2024-001-02", ""]
+        for date_str in cases:
+            with self.subTest(date_str=date_str):
+                self.assertEqual(self.parse_or_error(date_str), self.strptime_or_error(date_str))
+
+    def test_fuzz_matches_strptime(self):
+        rng = random.Random(7)
+        for _ in range(FUZZ_ROUNDS):
+            date_str = "".join(rng.choice("0123456789-- /x") for _ in range(rng.randint(6, 11)))
+            self.assertEqual(self.parse_or_error(date_str), self.strptime_or_error(date_str), msg=repr(date_str))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""磁力排序测试：默认权重必须与原先的“70% 高清档内取最小体积、同体积取最新日期”规则一致
+
+运行：python -m unittest discover -s tests （在 misaka改进版 目录下）
+"""
+import os
+import random
+import sys
+import unittest
+from datetime import date, timedelta
+
+for _name, _value in {
+    "TELEGRAM_TOKEN": "123:test", "ALIST_BASE_URL": "http://127.0.0.1:5244/", "ALIST_USERNAME": "test",
+    "ALIST_PASSWORD": "test", "ALIST_OFFLINE_DIR": "/test", "JAV_SEARCH_API": "http://127.0.0.1/api/",
+    "ALLOWED_USER_IDS": "1",
+}.items():
+    os.environ.setdefault(_name, _value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tgbot  # noqa: E402
+
+GB = 1024 ** 3
+
+
+def legacy_select(parsed_entries: list[dict]) -> dict:
+    """原实现（重构前 get_magnet 中的选择逻辑）"""
+    max_size = max(e["size_bytes"] for e in parsed_entries)
+    hd_threshold = max_size * 0.7
+    selected_cluster = [e for e in parsed_entries if e["size_bytes"] >= hd_threshold] or parsed_entries
+    selected_cluster.sort(key=lambda x: (x["size_bytes"], -(x["date"].toordinal() if x["date"] else 0)))
+    return selected_cluster[0]
+
+
+def entry(size_bytes: int, upload_date: date | None, name: str = "") -> dict:
+    return {"magnet": f"magnet:?xt=urn:btih:{random.getrandbits(160):040x}", "name": name,
+            "size_bytes": size_bytes, "date": upload_date, "seeders": None}
+
+
+def random_entries(rng: random.Random) -> list[dict]:
+    # 体积取自少量离散值，制造大量同体积/近体积的情况；日期可能缺失或重复
+    sizes = [int(s * GB) for s in (0.5, 1.1, 3.9, 5.0, 5.02, 5.4, 7.2)] + [0, 1]
+    dates = [None, date(2020, 1, 1), date(2024, 1, 2), date(2024, 1, 3)]
+    result = []
+    for _ in range(rng.randint(1, 12)):
+        size = rng.choice(sizes) if rng.random() < 0.7 else rng.randint(0, 8 * GB)
+        upload_date = rng.choice(dates) if rng.random() < 0.7 else date(2015, 1, 1) + timedelta(rng.randint(0, 4000))
+        result.append(entry(size, upload_date))
+    return result
+
+
+class RankEntriesTest(unittest.TestCase):
+    def test_size_outranks_recency(self):
+        old = entry(int(5.00 * GB), date(2020, 1, 1))
+        new = entry(int(5.02 * GB), date(2024, 1, 1))
+        self.assertIs(tgbot.select_entry([new, old]), old)
+
+    def test_dated_entry_preferred_on_equal_size(self):
+        undated = entry(5 * GB, None)
+        dated = entry(5 * GB, date(2020, 1, 1))
+        self.assertIs(tgbot.select_entry([undated, dated]), dated)
+
+    def test_newest_wins_on_equal_size(self):
+        older = entry(5 * GB, date(2020, 1, 1))
+        newer = entry(5 * GB, date(2024, 1, 1))
+        self.assertIs(tgbot.select_entry([older, newer]), newer)
+
+    def test_full_tie_keeps_original_order(self):
+        first, second = entry(5 * GB, None), entry(5 * GB, None)
+        self.assertIs(tgbot.select_entry([first, second]), first)
+        self.assertEqual(tgbot.rank_entries([first, second], 2), [first, second])
+
+    def test_smallest_in_hd_band(self):
+        entries = [entry(1 * GB, date(2024, 1, 1)), entry(10 * GB, None), entry(8 * GB, None)]
+        self.assertIs(tgbot.select_entry(entries), entries[2])
+
+    def test_random_lists_agree_with_legacy_rule(self):
+        rng = random.Random(3000)
+        for _ in range(3000):
+            entries = random_entries(rng)
+            self.assertIs(tgbot.select_entry(entries), legacy_select(list(entries)))
+
+    def test_top_n_starts_with_selected_entry(self):
+        rng = random.Random(5)
+        for _ in range(500):
+            entries = random_entries(rng)
+            top = tgbot.rank_entries(entries, 3)
+            self.assertIs(top[0], legacy_select(list(entries)))
+            self.assertEqual(len(top), min(3, len(entries)))
+
+
+if __name__ == "__main__":
+    unittest.main()
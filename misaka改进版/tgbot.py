@@ -1,20 +1,34 @@
-import requests
+import httpx
 import sys
 import re
 import logging
 import os
 import asyncio
 import ast
+import base64
+import binascii
+import bisect
+import heapq
+import json
+import operator
+import random
+import sqlite3
 import math
 import html
+import time
+import uuid
+import posixpath
 import urllib.parse
-from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
 
 from dotenv import load_dotenv
 from functools import wraps
 
 from telegram import Update
 from telegram.constants import ChatAction, ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
 # 加载.env 文件中的环境变量
@@ -40,7 +54,7 @@ BASE_URL = os.getenv("ALIST_BASE_URL")
 USERNAME = os.getenv("ALIST_USERNAME")
 PASSWORD = os.getenv("ALIST_PASSWORD")
 OFFLINE_DOWNLOAD_DIR = os.getenv("ALIST_OFFLINE_DIR")
-SEARCH_URL = os.getenv("JAV_SEARCH_API")
+SEARCH_URL = os.getenv("JAV_SEARCH_API")  # 可用逗号分隔填写多个镜像
 ALLOWED_USER_IDS_STR = os.getenv("ALLOWED_USER_IDS")
 # 新增：从.env 文件中加载自动清理间隔时间
 CLEAN_INTERVAL_MINUTES = int(os.getenv("CLEAN_INTERVAL_MINUTES", 60))
@@ -62,6 +76,80 @@ except ValueError:
 
 # --- 全局配置 ---
 TOKEN_EXPIRY_DURATION = timedelta(hours=24)  # Token 有效期 24 小时
+TOKEN_RENEW_MARGIN = timedelta(minutes=int(os.getenv("TOKEN_RENEW_MARGIN_MINUTES", 60)))  # 过期前多久后台续期
+
+# --- Alist 连接池配置 ---
+ALIST_MAX_CONNECTIONS = int(os.getenv("ALIST_MAX_CONNECTIONS", 20))  # 连接池最大连接数
+ALIST_MAX_KEEPALIVE = int(os.getenv("ALIST_MAX_KEEPALIVE", 10))  # 最大保活连接数
+ALIST_KEEPALIVE_EXPIRY = float(os.getenv("ALIST_KEEPALIVE_EXPIRY", 30))  # 空闲连接保活时间（秒）
+ALIST_TIMEOUT = float(os.getenv("ALIST_TIMEOUT", 30))  # 默认请求超时（秒）
+ALIST_CONNECT_TIMEOUT = float(os.getenv("ALIST_CONNECT_TIMEOUT", 10))  # 建立连接超时（秒）
+
+# --- 批量处理并发与限速配置 ---
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 4))  # 同时进行的番号搜索数
+SUBMIT_CONCURRENCY = int(os.getenv("SUBMIT_CONCURRENCY", 2))  # 同时进行的离线下载提交数
+SEARCH_RATE_LIMIT = float(os.getenv("SEARCH_RATE_LIMIT", 2))  # 搜索 API 每秒请求上限（0 不限速）
+ALIST_RATE_LIMIT = float(os.getenv("ALIST_RATE_LIMIT", 5))  # 向 Alist 提交离线任务的每秒请求上限（0 不限速；列目录、删除等不受限）
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))  # 连续失败多少次后熔断（0 关闭熔断）
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", 30))  # 熔断后多久放行一次探测请求（秒）
+BREAKER_MAX_RESET_SECONDS = float(os.getenv("BREAKER_MAX_RESET_SECONDS", 300))  # 探测连续失败时熔断时长的上限（秒）
+PIPELINE_BUFFER_SIZE = int(os.getenv("PIPELINE_BUFFER_SIZE", 20))  # 已搜索完成、等待提交的条目上限（搜索最多领先提交的数量）
+SEARCH_RETRIES = int(os.getenv("SEARCH_RETRIES", 2))  # 批量搜索遇到超时/服务异常时的重试次数
+SUBMIT_RETRIES = int(os.getenv("SUBMIT_RETRIES", 1))  # 批量提交遇到超时/连接失败时的重试次数
+SUBMIT_CHUNK_SIZE = int(os.getenv("SUBMIT_CHUNK_SIZE", 10))  # 批量提交时每个 add_offline_download 请求包含的磁力数
+SUBMIT_BATCH_WINDOW = float(os.getenv("SUBMIT_BATCH_WINDOW", 3))  # 批量提交前最多等待多久凑齐一块（秒，搜索全部结束时立即提交）
+
+# --- 目录遍历配置 ---
+WALK_CONCURRENCY = int(os.getenv("WALK_CONCURRENCY", 8))  # 同时进行的 /api/fs/list 请求数
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", 500))  # /api/fs/list 每页条目数（0 为一次取回整个目录）
+WALK_MAX_DEPTH = int(os.getenv("WALK_MAX_DEPTH", 32))  # 最大遍历深度
+WALK_MAX_ENTRIES = int(os.getenv("WALK_MAX_ENTRIES", 200000))  # 单次遍历最多处理的条目数
+REMOVE_RETRIES = int(os.getenv("REMOVE_RETRIES", 2))  # /api/fs/remove 失败后的重试次数
+DIR_INDEX_TTL = int(os.getenv("DIR_INDEX_TTL", 600))  # 下载目录名称索引的最长缓存时间（秒）
+DIR_INDEX_FRESH_SECONDS = 5  # 建立不足该秒数的索引视为最新，未命中时不再重新列出
+CLEAN_PLAN_TTL = int(os.getenv("CLEAN_PLAN_TTL", 600))  # /clean plan 生成的清理计划有效期（秒）
+CLEAN_FULL_SCAN_HOURS = float(os.getenv("CLEAN_FULL_SCAN_HOURS", 24))  # 自动清理多久做一次完整遍历（其余为增量遍历）
+CLEAN_ON_COMPLETE = os.getenv("CLEAN_ON_COMPLETE", "true").lower() == "true"  # 下载完成后自动清理对应目录
+CLEAN_EVENT_DELAY_SECONDS = float(os.getenv("CLEAN_EVENT_DELAY_SECONDS", 60))  # 下载完成后等待多久再清理（秒）
+CLEAN_SWEEP_HOURS = float(os.getenv("CLEAN_SWEEP_HOURS", 24))  # 启用完成后清理时，兜底全目录清理的间隔（小时）
+
+# --- 多镜像搜索配置 ---
+SEARCH_HEDGE_DELAY = float(os.getenv("SEARCH_HEDGE_DELAY", 1.5))  # 延迟样本不足时，多久未返回就向第二个镜像发出对冲请求（秒）
+SEARCH_HEDGE_MIN_DELAY = float(os.getenv("SEARCH_HEDGE_MIN_DELAY", 0.2))  # 对冲延迟下限（秒）
+SEARCH_LATENCY_ALPHA = 0.2  # 镜像延迟移动平均的平滑系数
+
+# --- 搜索缓存配置 ---
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1000))  # 最多缓存的番号数（0 关闭缓存）
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 6 * 3600))  # 命中结果缓存时间（秒）
+SEARCH_CACHE_NEGATIVE_TTL = int(os.getenv("SEARCH_CACHE_NEGATIVE_TTL", 600))  # 未找到结果缓存时间（秒）
+
+# --- 磁力排序配置（默认权重等价于原“体积聚类 + 小体积优先 + 新日期优先”逻辑）---
+RANK_BAND_RATIO = float(os.getenv("RANK_BAND_RATIO", 0.7))  # 体积 >= 最大体积 * 该比例视为高清档
+RANK_WEIGHT_BAND = float(os.getenv("RANK_WEIGHT_BAND", 1000))  # 位于高清档的加分
+RANK_WEIGHT_SIZE = float(os.getenv("RANK_WEIGHT_SIZE", 100))  # 体积越小加分越多（按最大体积归一化）
+RANK_WEIGHT_RECENCY = float(os.getenv("RANK_WEIGHT_RECENCY", 0))  # 发布日期越新加分越多（日期始终用于同分时排序）
+RANK_WEIGHT_KEYWORD = float(os.getenv("RANK_WEIGHT_KEYWORD", 0))  # 每命中一个关键字的加分（可为负数）
+RANK_WEIGHT_SEEDERS = float(os.getenv("RANK_WEIGHT_SEEDERS", 0))  # 做种数加分（对数归一化）
+RANK_KEYWORDS = [k.strip().lower() for k in os.getenv("RANK_KEYWORDS", "中文字幕,字幕,-C,-UC,无码,uncensored").split(',') if k.strip()]
+RANK_TOP_N = int(os.getenv("RANK_TOP_N", 3))  # 批量任务保留的候选磁力数（首选被拒时依次尝试）
+
+# --- 后台刷新配置 ---
+REFRESH_DEBOUNCE_SECONDS = float(os.getenv("REFRESH_DEBOUNCE_SECONDS", 5))  # 最后一次提交后等待多久再刷新
+REFRESH_MAX_DELAY_SECONDS = float(os.getenv("REFRESH_MAX_DELAY_SECONDS", 30))  # 持续提交时最长推迟时间
+
+# --- 进度消息配置 ---
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", 3))  # 同一条进度消息两次编辑的最小间隔（秒）
+
+# --- 本地持久化配置 ---
+BOT_DATA_DIR = os.getenv("BOT_DATA_DIR", "data")  # 本地数据目录（Render 上应挂载持久化磁盘）
+DUPLICATE_WINDOW_DAYS = int(os.getenv("DUPLICATE_WINDOW_DAYS", 30))  # 多少天内重复提交视为重复（0 为永久）
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 7))  # 已完成批量任务记录的保留天数
+
+# --- 离线任务跟踪配置 ---
+TASK_TRACKING_ENABLED = os.getenv("TASK_TRACKING_ENABLED", "true").lower() == "true"  # 是否跟踪离线任务并推送完成通知
+TASK_POLL_MIN_SECONDS = float(os.getenv("TASK_POLL_MIN_SECONDS", 10))  # 有活跃任务时的轮询间隔（秒）
+TASK_POLL_MAX_SECONDS = float(os.getenv("TASK_POLL_MAX_SECONDS", 60))  # 活跃任务很多时的最长轮询间隔（秒）
+TASK_POLL_IDLE_SECONDS = float(os.getenv("TASK_POLL_IDLE_SECONDS", 300))  # 没有活跃任务时的轮询间隔（秒）
 
 # --- 用户授权装饰器 ---
 def restricted(func):
@@ -72,7 +160,7 @@ def restricted(func):
             logger.warning(f"未授权用户尝试访问: {user_id}")
             await update.message.reply_text("抱歉，您没有权限使用此机器人。")
             return
-        # 检查并获取 token，存储在 bot_data 中
+        # 检查并获取 token（由 token_manager 统一缓存与续期）
         token = await get_token(context)
         if not token:
             await update.message.reply_text("错误: 无法连接或登录到 Alist 服务。")
@@ -81,6 +169,243 @@ def restricted(func):
         return await func(update, context, token=token, *args, **kwargs)
     return wrapped
 
+# --- HTTP 客户端 ---
+class RateLimiter:
+    """最小间隔限速器：每秒最多 rate 次请求（rate 为 0 时不限速）"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self) -> None:
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """带随机抖动的指数退避（full jitter），避免大量请求在同一时刻重试"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitOpenError(httpx.TransportError):
+    """上游处于熔断状态，请求被直接拒绝（继承 TransportError，调用方按连接失败处理）"""
+
+
+# 视为上游故障的响应状态码（其余状态码说明上游可用）
+BREAKER_FAILURE_STATUS = {502, 503, 504}
+
+
+class CircuitBreaker:
+    """单个上游的熔断器：连续失败达到阈值后熔断（快速失败），冷却后放行一个探测请求（半开），
+    探测成功则恢复，失败则按指数延长熔断时间"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    LABELS = {CLOSED: "🟢 正常", OPEN: "🔴 熔断", HALF_OPEN: "🟡 探测中"}
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0  # 累计熔断次数
+        self.rejected = 0  # 熔断期间被直接拒绝的请求数
+        self.reset_timeout = BREAKER_RESET_SECONDS
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def before_request(self) -> None:
+        if BREAKER_FAILURE_THRESHOLD <= 0 or self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name} 熔断中，{self.retry_in():.0f} 秒后重试")
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name} 已恢复，关闭熔断")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.reset_timeout = BREAKER_RESET_SECONDS
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            # 探测失败：重新熔断，熔断时间加倍
+            self.reset_timeout = min(self.reset_timeout * 2, BREAKER_MAX_RESET_SECONDS)
+            self._open()
+        elif self.state == self.CLOSED and BREAKER_FAILURE_THRESHOLD > 0 and self.failures >= BREAKER_FAILURE_THRESHOLD:
+            self._open()
+
+    def release(self) -> None:
+        """请求被取消、没有结论时释放探测名额"""
+        self._probe_in_flight = False
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self.trips += 1
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        logger.warning(f"{self.name} 连续失败 {self.failures} 次，熔断 {self.reset_timeout:.0f} 秒")
+
+    def retry_in(self) -> float:
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def describe(self) -> str:
+        text = f"{self.name}: {self.LABELS[self.state]}"
+        if self.state == self.OPEN:
+            text += f" ({self.retry_in():.0f} 秒后探测)"
+        return text + f" | 连续失败 {self.failures} | 熔断 {self.trips} 次 | 拒绝 {self.rejected} 次"
+
+
+class PooledHttpClient:
+    """共享的异步 HTTP 客户端（连接池 + keep-alive + 按主机限速与熔断），由 Application 生命周期管理"""
+
+    def __init__(self, name: str, base_url: str = "", rate_limit: float = 0, rate_limited_paths: tuple[str, ...] = ()):
+        self.name = name
+        self.base_url = base_url.rstrip('/') + '/' if base_url else ""
+        self.rate_limit = rate_limit
+        self.rate_limited_paths = rate_limited_paths  # 只对这些 API 路径限速，为空时对所有请求限速
+        self._limiters: dict[str, RateLimiter] = {}
+        self.breakers: dict[str, CircuitBreaker] = {}
+        self._client: httpx.AsyncClient | None = None
+        # 认证失败时的 token 刷新回调：接收失效 token，返回新 token
+        self.token_refresher = None
+
+    async def start(self) -> None:
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            limits=httpx.Limits(
+                max_connections=ALIST_MAX_CONNECTIONS,
+                max_keepalive_connections=ALIST_MAX_KEEPALIVE,
+                keepalive_expiry=ALIST_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(ALIST_TIMEOUT, connect=ALIST_CONNECT_TIMEOUT),
+        )
+        logger.info(f"{self.name} 连接池已创建 (最大连接 {ALIST_MAX_CONNECTIONS}, 保活 {ALIST_MAX_KEEPALIVE})")
+
+    async def close(self) -> None:
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        logger.info(f"{self.name} 连接池已关闭")
+
+    def _host(self, url: str) -> str:
+        return urllib.parse.urlsplit(url).netloc or urllib.parse.urlsplit(self.base_url).netloc
+
+    def _rate_limited(self, url: str) -> bool:
+        if not self.rate_limited_paths:
+            return True
+        path = urllib.parse.urlsplit(url).path.lstrip('/')
+        return any(path.startswith(prefix) for prefix in self.rate_limited_paths)
+
+    def _limiter_for(self, url: str) -> RateLimiter:
+        host = self._host(url)
+        limiter = self._limiters.get(host)
+        if limiter is None:
+            limiter = self._limiters[host] = RateLimiter(self.rate_limit)
+        return limiter
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        host = self._host(url)
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(f"{self.name} ({host})")
+        return breaker
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if self._client is None:
+            await self.start()
+        # 熔断时直接失败，不占用限速名额也不等待超时
+        breaker = self.breaker_for(url)
+        breaker.before_request()
+        if kwargs.get("timeout") is None:
+            kwargs.pop("timeout", None)
+        try:
+            if self._rate_limited(url):
+                await self._limiter_for(url).acquire()
+            response = await self._client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        if response.status_code in BREAKER_FAILURE_STATUS:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    async def get(self, url: str, timeout: float | None = None) -> httpx.Response:
+        return await self.request("GET", url, timeout=timeout)
+
+    async def post(self, api_path: str, payload: dict, token: str | None = None,
+                   timeout: float | None = None) -> httpx.Response:
+        """发送 JSON POST 请求（相对路径形如 /api/fs/list 时基于 base_url）"""
+        return await self.api_request("POST", api_path, token, timeout, json=payload)
+
+    async def api_request(self, method: str, api_path: str, token: str | None = None,
+                          timeout: float | None = None, **kwargs) -> httpx.Response:
+        """带认证头的 API 请求，token 失效时自动刷新并重试一次"""
+        url = api_path.lstrip('/') if self.base_url else api_path
+        response = await self.request(method, url, headers=self._headers(token), timeout=timeout, **kwargs)
+        if token and self.token_refresher and is_unauthorized(response):
+            # token 失效：刷新（并发请求共享同一次登录）后透明重试一次
+            new_token = await self.token_refresher(token)
+            if new_token and new_token != token:
+                response = await self.request(method, url, headers=self._headers(new_token),
+                                              timeout=timeout, **kwargs)
+        return response
+
+    @staticmethod
+    def _headers(token: str | None) -> dict:
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = token
+        return headers
+
+
+AUTH_ERROR_BODY_LIMIT = 1024  # 认证失败的响应体很小，超过该长度的响应不做 JSON 解码
+AUTH_ERROR_CODE_REGEX = re.compile(rb'"code"\s*:\s*401\b')
+
+
+def is_unauthorized(response: httpx.Response) -> bool:
+    """Alist 认证失败既可能是 HTTP 401，也可能是 HTTP 200 + 业务码 401。
+    只对短响应体做检查，大响应（如分页目录列表）不会被额外解码一次"""
+    if response.status_code == 401:
+        return True
+    if response.status_code != 200:
+        return False
+    body = response.content
+    if len(body) > AUTH_ERROR_BODY_LIMIT or not AUTH_ERROR_CODE_REGEX.search(body):
+        return False
+    try:
+        result = response.json()
+    except ValueError:
+        return False
+    return isinstance(result, dict) and result.get("code") == 401
+
+
+# 限速只用于提交离线任务（替代原先的 BATCH_DELAY），目录遍历、删除和任务轮询不受限
+alist_client = PooledHttpClient("Alist", BASE_URL, rate_limit=ALIST_RATE_LIMIT,
+                                rate_limited_paths=("api/fs/add_offline_download",))
+search_client = PooledHttpClient("搜索 API", rate_limit=SEARCH_RATE_LIMIT)
+
 # --- API 函数 ---
 
 def parse_size_to_bytes(size_str: str) -> int | None:
@@ -114,10 +439,59 @@ def parse_size_to_bytes(size_str: str) -> int | None:
 
     return int(value * (1024 ** exponent))
 
+def split_entry_list(entry_str: str) -> list[str] | None:
+    """快速解析 "['magnet', 'name', 'size', 'date']" 形式的字符串列表。
+
+    只处理不含转义的纯字符串元素；遇到转义、非字符串元素等无法确定的情况返回 None，
+    由调用方回退到 ast.literal_eval，保证结果与原实现一致。
+    """
+    s = entry_str.strip()
+    if len(s) < 2 or s[0] != '[' or s[-1] != ']':
+        return None
+    end = len(s) - 1
+    i = 1
+    items = []
+    while True:
+        while i < end and s[i] in ' \t':
+            i += 1
+        if i == end:
+            return items
+        quote = s[i]
+        if quote not in "'\"":
+            return None
+        close = s.find(quote, i + 1)
+        if close == -1 or close >= end:
+            return None
+        value = s[i + 1:close]
+        if '\\' in value or '\n' in value or '\r' in value:
+            return None
+        items.append(value)
+        i = close + 1
+        while i < end and s[i] in ' \t':
+            i += 1
+        if i == end:
+            return items
+        if s[i] != ',':
+            return None
+        i += 1
+
+
+def parse_upload_date(date_str: str):
+    """解析 YYYY-MM-DD 日期；标准格式走 C 实现的 fromisoformat，其余交给 strptime"""
+    if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-' and date_str[:4].isdigit():
+        try:
+            return date.fromisoformat(date_str)
+        except ValueError:
+            pass
+    return datetime.strptime(date_str, '%Y-%m-%d').date()
+
+
 def parse_api_data_entry(entry_str: str) -> dict | None:
     """Parses a single string entry from the API data list."""
     try:
-        data_list = ast.literal_eval(entry_str)
+        data_list = split_entry_list(entry_str)
+        if data_list is None:
+            data_list = ast.literal_eval(entry_str)
         if not isinstance(data_list, list) or len(data_list) < 4:
             logger.warning(f"解析后的数据格式不正确 (非列表或长度不足): {data_list}")
             return None
@@ -139,10 +513,18 @@ def parse_api_data_entry(entry_str: str) -> dict | None:
         upload_date = None
         try:
             if date_str:
-                upload_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+                upload_date = parse_upload_date(date_str)
         except ValueError:
             logger.warning(f"无法解析日期 '{date_str}'，日期将为 None")
 
+        # 部分搜索源在第 5 项提供做种数
+        seeders = None
+        if len(data_list) > 4:
+            try:
+                seeders = int(data_list[4])
+            except (TypeError, ValueError):
+                seeders = None
+
         return {
             "magnet": magnet,
             "name": name,
@@ -150,6 +532,7 @@ def parse_api_data_entry(entry_str: str) -> dict | None:
             "size_bytes": size_bytes,
             "date_str": date_str,
             "date": upload_date,
+            "seeders": seeders,
             "original_string": entry_str
         }
 
@@ -157,12 +540,115 @@ def parse_api_data_entry(entry_str: str) -> dict | None:
         logger.error(f"解析 API 数据条目时出错: '{entry_str[:100]}...', 错误: {e}")
         return None
 
-def get_magnet(fanhao: str, search_url: str) -> tuple[str | None, str | None]:
-    """获取磁力链接（优化版用户提示）"""
+class SearchCache:
+    """番号搜索结果缓存（TTL 过期 + LRU 淘汰）"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> dict | None:
+        item = self._items.get(key)
+        if item is not None:
+            expires_at, value = item
+            if expires_at > time.monotonic():
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._items[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict, ttl: float) -> None:
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        self._items[key] = (time.monotonic() + ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return f"{len(self._items)}/{self.max_size} 条, 命中 {self.hits}, 未命中 {self.misses} ({ratio:.0f}%)"
+
+
+search_cache = SearchCache(SEARCH_CACHE_SIZE)
+
+
+def normalize_fanhao(fanhao: str) -> str:
+    """番号标准化（忽略大小写与分隔符），用作缓存键"""
+    return re.sub(r'[^A-Z0-9]', '', fanhao.upper())
+
+
+_SIZE_GETTER = operator.itemgetter("size_bytes")
+_DATE_GETTER = operator.itemgetter("date")
+
+
+def rank_entries(parsed_entries: list[dict], top_n: int = 1) -> list[dict]:
+    """按可配置权重为候选磁力打分，返回得分最高的 top_n 个条目"""
+    if not parsed_entries:
+        return []
+
+    # 按列提取特征，避免在打分阶段反复查字典
+    sizes = list(map(_SIZE_GETTER, parsed_entries))
+    dates = list(map(_DATE_GETTER, parsed_entries))
+    max_size = max(sizes)
+
+    # 体积档 + 体积项：一次列表推导完成
+    band_threshold = max_size * RANK_BAND_RATIO
+    size_scale = RANK_WEIGHT_SIZE / max_size if max_size else 0.0
+    base = RANK_WEIGHT_BAND + RANK_WEIGHT_SIZE
+    scores = [(base if size >= band_threshold else RANK_WEIGHT_SIZE) - size * size_scale for size in sizes]
+
+    # 以下各项仅在权重非零且数据可用时计算
+    known_dates = [d for d in dates if d is not None] if RANK_WEIGHT_RECENCY else []
+    if known_dates:
+        min_date = min(known_dates)
+        day_span = (max(known_dates) - min_date).days
+        if day_span:
+            recency_scale = RANK_WEIGHT_RECENCY / day_span
+            for i, upload_date in enumerate(dates):
+                if upload_date is not None:
+                    scores[i] += (upload_date - min_date).days * recency_scale
+    if RANK_WEIGHT_KEYWORD and RANK_KEYWORDS:
+        for i, e in enumerate(parsed_entries):
+            name = (e["name"] or "").lower()
+            hits = sum(1 for k in RANK_KEYWORDS if k in name)
+            if hits:
+                scores[i] += RANK_WEIGHT_KEYWORD * hits
+    if RANK_WEIGHT_SEEDERS:
+        seeders = [e.get("seeders") or 0 for e in parsed_entries]
+        max_seeders = max(seeders)
+        if max_seeders > 0:
+            seeders_scale = RANK_WEIGHT_SEEDERS / math.log1p(max_seeders)
+            for i, count in enumerate(seeders):
+                if count > 0:
+                    scores[i] += math.log1p(count) * seeders_scale
+
+    # 同分时日期新者优先、有日期者优先（与原先按 (体积, -日期) 排序一致），其后保持原顺序
+    keys = [(score, upload_date.toordinal() if upload_date else 0) for score, upload_date in zip(scores, dates)]
+
+    # 堆选取，无需整体排序
+    if top_n <= 1:
+        return [parsed_entries[max(range(len(keys)), key=keys.__getitem__)]]
+    best = heapq.nlargest(top_n, range(len(keys)), key=keys.__getitem__)
+    return [parsed_entries[i] for i in best]
+
+
+def select_entry(parsed_entries: list[dict]) -> dict:
+    """智能选择：返回排序得分最高的条目"""
+    return rank_entries(parsed_entries, 1)[0]
+
+
+async def search_fanhao(fanhao: str, search_url: str) -> tuple[list[dict] | None, str | None, bool]:
+    """请求搜索 API，返回 (解析后的条目, 错误提示, 错误结果是否可缓存)"""
     try:
         url = search_url.rstrip('/') + "/" + fanhao
         logger.info(f"正在搜索番号: {fanhao}")
-        response = requests.get(url, timeout=20)  # 明确定义 response
+        response = await search_client.get(url, timeout=20)  # 明确定义 response
         response.raise_for_status()
 
         raw_result = response.json()
@@ -171,11 +657,11 @@ def get_magnet(fanhao: str, search_url: str) -> tuple[str | None, str | None]:
         if not raw_result or raw_result.get("status") != "succeed":
             error_type = raw_result.get('message', '未知错误')
             if "not found" in error_type.lower():
-                return None, f"🔍 未找到番号 {fanhao} 相关资源"
-            return None, f"🔍 搜索服务异常 ({error_type[:20]}...)"
+                return None, f"🔍 未找到番号 {fanhao} 相关资源", True
+            return None, f"🔍 搜索服务异常 ({error_type[:20]}...)", False
 
         if not raw_result.get("data") or len(raw_result["data"]) == 0:
-            return None, f"🔍 番号 {fanhao} 暂无有效磁力"
+            return None, f"🔍 番号 {fanhao} 暂无有效磁力", True
 
         # --- 解析数据条目 ---
         parsed_entries = []
@@ -185,268 +671,883 @@ def get_magnet(fanhao: str, search_url: str) -> tuple[str | None, str | None]:
                 parsed_entries.append(parsed)
 
         if not parsed_entries:
-            return None, f"🔍 找到资源但无有效磁力"
-
-        # --- 智能选择逻辑（保持原样）---
-        max_size = max(e["size_bytes"] for e in parsed_entries)
-        hd_threshold = max_size * 0.7
-        selected_cluster = [e for e in parsed_entries if e["size_bytes"] >= hd_threshold] or parsed_entries
-
-        selected_cluster.sort(
-            key=lambda x: (x["size_bytes"],
-                         -(x["date"].toordinal() if x["date"] else 0)))
+            return None, f"🔍 找到资源但无有效磁力", True
 
-        return selected_cluster[0]["magnet"], None
+        return parsed_entries, None, False
 
     # --- 异常处理（优化提示）---
-    except requests.exceptions.Timeout:
+    except CircuitOpenError as e:
+        return None, f"🔌 搜索服务暂时不可用（{e}）", False
+
+    except httpx.TimeoutException:
         logger.error(f"搜索超时 ({fanhao})")
-        return None, "⏳ 搜索超时，请检查网络连接"
+        return None, "⏳ 搜索超时，请检查网络连接", False
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         # 确保 e.response 存在
         status_code = e.response.status_code  # 正确引用 e.response
+        if status_code in BREAKER_FAILURE_STATUS:
+            # 网关/服务暂时不可用：不缓存，批量处理时按服务异常重试
+            return None, f"🔍 搜索服务异常 (HTTP {status_code})", False
         if 500 <= status_code < 600 or status_code == 404:
-            return None, f"🔍 番号 {fanhao} 不存在"
-        return None, f"🔍 搜索服务异常 (HTTP {status_code})"
+            return None, f"🔍 番号 {fanhao} 不存在", True
+        return None, f"🔍 搜索服务异常 (HTTP {status_code})", False
 
     except Exception as e:
         logger.error(f"未知错误 ({fanhao}): {str(e)}", exc_info=True)
         if "timed out" in str(e).lower():
-            return None, "⏳ 操作超时，请稍后重试"
-        return None, "🔍 搜索时发生意外错误"
+            return None, "⏳ 操作超时，请稍后重试", False
+        return None, "🔍 搜索时发生意外错误", False
 
-async def get_token(context: ContextTypes.DEFAULT_TYPE) -> str | None:
-    """获取 Alist Token，带有效期缓存"""
-    bot_data = context.bot_data
-    token = bot_data.get("alist_token")
-    token_expiry = bot_data.get("token_expiry")
 
-    if token and token_expiry and datetime.now() < token_expiry:
-        logger.info("使用有效缓存的 Alist token")
-        return token
+class SearchMirror:
+    """单个搜索镜像的延迟统计：指数移动平均用于选择镜像，近期样本的 p95 用作对冲延迟"""
 
-    try:
-        url = BASE_URL.rstrip('/') + "/api/auth/login"
-        logger.info("缓存 token 无效或过期，正在重新获取...")
-        login_info = {"username": USERNAME, "password": PASSWORD}
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(
-            None, lambda: requests.post(url, json=login_info, timeout=15)
-        )
-        response.raise_for_status()
+    def __init__(self, url: str):
+        self.url = url
+        self.host = urllib.parse.urlsplit(url).netloc or url
+        self.ewma: float | None = None
+        self.samples: deque[float] = deque(maxlen=100)
+        self.requests = 0
+        self.wins = 0
 
-        result = response.json()
-        if result.get("code") == 200 and result.get("data") and result["data"].get("token"):
-            token = str(result['data']['token'])
-            bot_data["alist_token"] = token
-            bot_data["token_expiry"] = datetime.now() + TOKEN_EXPIRY_DURATION
-            logger.info("成功获取并缓存新的 Alist token")
-            return token
+    def observe(self, elapsed: float) -> None:
+        self.samples.append(elapsed)
+        if self.ewma is None:
+            self.ewma = elapsed
         else:
-            error_msg = result.get('message', '未知错误')
-            logger.error(f"Alist 登录失败: {error_msg} (Code: {result.get('code', 'N/A')})")
+            self.ewma = SEARCH_LATENCY_ALPHA * elapsed + (1 - SEARCH_LATENCY_ALPHA) * self.ewma
+
+    def p95(self) -> float | None:
+        if len(self.samples) < 10:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def available(self) -> bool:
+        breaker = search_client.breakers.get(self.host)
+        return breaker is None or breaker.state != CircuitBreaker.OPEN
+
+    def describe(self) -> str:
+        ewma = f"{self.ewma * 1000:.0f}ms" if self.ewma is not None else "-"
+        p95 = self.p95()
+        p95_text = f"{p95 * 1000:.0f}ms" if p95 is not None else "-"
+        return f"{self.host}: 平均 {ewma} | p95 {p95_text} | 请求 {self.requests} | 采用 {self.wins}"
+
+
+class MirrorSearch:
+    """多镜像搜索：优先请求平均延迟最低的镜像，超过其 p95 仍未返回时向下一个镜像发出对冲请求，
+    先返回有效结果者胜出并取消其余请求；镜像失败时依次故障转移"""
+
+    def __init__(self, urls: list[str]):
+        self.mirrors = [SearchMirror(url) for url in urls]
+        self.hedges = 0
+
+    def ranked(self) -> list[SearchMirror]:
+        # 熔断中的镜像排在最后；还没有样本的镜像视为最快，保证每个镜像都会被尝试
+        return sorted(self.mirrors, key=lambda m: (not m.available(), m.ewma or 0.0))
+
+    @staticmethod
+    def hedge_delay(mirror: SearchMirror) -> float:
+        p95 = mirror.p95()
+        return max(SEARCH_HEDGE_MIN_DELAY, p95 if p95 is not None else SEARCH_HEDGE_DELAY)
+
+    async def _timed(self, mirror: SearchMirror, fanhao: str) -> tuple[list[dict] | None, str | None, bool]:
+        mirror.requests += 1
+        started = time.monotonic()
+        try:
+            entries, error, cacheable = await search_fanhao(fanhao, mirror.url)
+        except asyncio.CancelledError:
+            # 被对冲请求抢先：已等待的时长是其延迟的下限，记入统计，避免慢镜像一直排在前面
+            mirror.observe(time.monotonic() - started)
+            raise
+        # 只统计镜像给出明确答复的耗时（超时、熔断等失败由熔断器负责）
+        if entries or cacheable:
+            mirror.observe(time.monotonic() - started)
+        return entries, error, cacheable
+
+    async def search(self, fanhao: str) -> tuple[list[dict] | None, str | None, bool]:
+        """返回格式与 search_fanhao 相同：(条目, 错误提示, 错误结果是否可缓存)"""
+        order = self.ranked()
+        if len(order) == 1:
+            return await self._timed(order[0], fanhao)
+
+        tasks: dict[asyncio.Task, SearchMirror] = {}
+        next_index = 0
+
+        def launch() -> None:
+            nonlocal next_index
+            mirror = order[next_index]
+            next_index += 1
+            tasks[asyncio.create_task(self._timed(mirror, fanhao))] = mirror
+
+        launch()
+        pending = set(tasks)
+        successes: list[tuple[SearchMirror, list[dict]]] = []
+        failures: list[tuple[str | None, bool]] = []
+        hedge_at = time.monotonic() + self.hedge_delay(order[0])
+        try:
+            while pending:
+                timeout = None
+                if next_index == 1:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 首选镜像超过对冲延迟仍未返回
+                    self.hedges += 1
+                    launch()
+                    pending = {t for t in tasks if not t.done()}
+                    continue
+                for task in done:
+                    entries, error, cacheable = task.result()
+                    if entries:
+                        successes.append((tasks[task], entries))
+                    else:
+                        failures.append((error, cacheable))
+                if successes:
+                    break
+                if not pending and next_index < len(order):
+                    launch()  # 故障转移到下一个镜像
+                    pending = {t for t in tasks if not t.done()}
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if successes:
+            successes[0][0].wins += 1
+            return merge_search_entries([entries for _, entries in successes]), None, False
+        error = failures[0][0] if failures else "🔍 搜索时发生意外错误"
+        # 所有镜像都明确答复“无结果”时才缓存
+        return None, error, bool(failures) and all(cacheable for _, cacheable in failures)
+
+
+def merge_search_entries(results: list[list[dict]]) -> list[dict]:
+    """合并多个镜像的结果，按 info-hash 去重（保留先返回的条目）"""
+    merged = []
+    seen = set()
+    for entries in results:
+        for entry in entries:
+            key = extract_info_hash(entry["magnet"]) or entry["magnet"]
+            if key not in seen:
+                seen.add(key)
+                merged.append(entry)
+    return merged
+
+
+_mirror_searches: dict[str, MirrorSearch] = {}
+
+
+def mirror_search_for(search_url: str) -> MirrorSearch:
+    """search_url 可为逗号分隔的多个镜像地址"""
+    mirror_search = _mirror_searches.get(search_url)
+    if mirror_search is None:
+        urls = [url.strip() for url in search_url.split(',') if url.strip()]
+        mirror_search = _mirror_searches[search_url] = MirrorSearch(urls)
+    return mirror_search
+
+
+async def get_magnet_candidates(fanhao: str, search_url: str,
+                                top_n: int = 1) -> tuple[list[dict], str | None]:
+    """获取得分最高的 top_n 个磁力条目（含体积等信息，带结果缓存）"""
+    cache_key = normalize_fanhao(fanhao)
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"命中搜索缓存: {fanhao}")
+        if cached["error"]:
+            return [], cached["error"]
+        ranked = cached["ranked"]
+        if top_n > len(ranked) and len(cached["entries"]) > len(ranked):
+            ranked = rank_entries(cached["entries"], top_n)
+        return ranked[:top_n], None
+
+    parsed_entries, error, cacheable = await mirror_search_for(search_url).search(fanhao)
+    if parsed_entries:
+        ranked = rank_entries(parsed_entries, max(top_n, RANK_TOP_N))
+        search_cache.put(cache_key, {"entries": parsed_entries, "ranked": ranked, "error": None},
+                         SEARCH_CACHE_TTL)
+        return ranked[:top_n], None
+
+    if cacheable:
+        search_cache.put(cache_key, {"entries": [], "ranked": [], "error": error}, SEARCH_CACHE_NEGATIVE_TTL)
+    return [], error
+
+
+async def get_magnet_entry(fanhao: str, search_url: str) -> tuple[dict | None, str | None]:
+    """获取选中的磁力条目（含体积等信息）"""
+    candidates, error = await get_magnet_candidates(fanhao, search_url)
+    return (candidates[0], None) if candidates else (None, error)
+
+
+async def get_magnet(fanhao: str, search_url: str) -> tuple[str | None, str | None]:
+    """获取磁力链接（优化版用户提示，带结果缓存）"""
+    entry, error = await get_magnet_entry(fanhao, search_url)
+    return (entry["magnet"], None) if entry else (None, error)
+
+class TokenManager:
+    """Alist token 管理：并发刷新合并为一次登录，并在过期前后台续期"""
+
+    def __init__(self):
+        self.token: str | None = None
+        self.expiry: datetime | None = None
+        self._login_task: asyncio.Task | None = None
+        self._renew_task: asyncio.Task | None = None
+
+    def is_valid(self) -> bool:
+        return bool(self.token and self.expiry and datetime.now() < self.expiry)
+
+    async def get(self) -> str | None:
+        if self.is_valid():
+            return self.token
+        logger.info("缓存 token 无效或过期，正在重新获取...")
+        return await self.refresh()
+
+    async def refresh(self, stale_token: str | None = None) -> str | None:
+        """刷新 token；若 stale_token 已被其他请求替换，直接返回当前 token"""
+        if stale_token and self.token and self.token != stale_token and self.is_valid():
+            return self.token
+        if self._login_task is None or self._login_task.done():
+            self._login_task = asyncio.create_task(self._login())
+        # shield：单个调用方被取消时不影响其他等待同一次登录的请求
+        return await asyncio.shield(self._login_task)
+
+    def invalidate(self, token: str | None = None) -> None:
+        if token is None or token == self.token:
+            self.token = None
+            self.expiry = None
+
+    async def _login(self) -> str | None:
+        try:
+            login_info = {"username": USERNAME, "password": PASSWORD}
+            response = await alist_client.post("/api/auth/login", login_info, timeout=15)
+            response.raise_for_status()
+
+            result = response.json()
+            if result.get("code") == 200 and result.get("data") and result["data"].get("token"):
+                self.token = str(result['data']['token'])
+                self.expiry = datetime.now() + TOKEN_EXPIRY_DURATION
+                logger.info("成功获取并缓存新的 Alist token")
+                return self.token
+            else:
+                error_msg = result.get('message', '未知错误')
+                logger.error(f"Alist 登录失败: {error_msg} (Code: {result.get('code', 'N/A')})")
+                return None
+        except httpx.HTTPError as e:
+            logger.error(f"登录 Alist 获取 token 时出错: {str(e)}")
+            return None
+        except Exception as e:
+            logger.error(f"登录 Alist 过程中发生未知错误: {str(e)}", exc_info=True)
+            return None
+
+    async def _renew_loop(self) -> None:
+        while True:
+            if self.is_valid():
+                delay = (self.expiry - TOKEN_RENEW_MARGIN - datetime.now()).total_seconds()
+            else:
+                delay = 0
+            await asyncio.sleep(max(delay, 1))
+            if await self.refresh() is None:
+                # 登录失败：一分钟后重试，期间仍沿用旧 token（若尚未过期）
+                await asyncio.sleep(60)
+
+    async def start(self) -> None:
+        """启动时预先登录，并启动后台续期任务"""
+        await self.refresh()
+        if self._renew_task is None:
+            self._renew_task = asyncio.create_task(self._renew_loop())
+
+    async def stop(self) -> None:
+        for task in (self._renew_task, self._login_task):
+            if task and not task.done():
+                task.cancel()
+        self._renew_task = None
+
+
+token_manager = TokenManager()
+alist_client.token_refresher = token_manager.refresh
+
+
+async def get_token(context: ContextTypes.DEFAULT_TYPE) -> str | None:
+    """获取 Alist Token，带有效期缓存（正常情况下由后台提前续期，无需等待登录）"""
+    return await token_manager.get()
+
+
+class SubmissionIndex:
+    """已提交磁力的本地持久化索引（SQLite），用于在请求 Alist 前拦截重复任务"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        if self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            " info_hash TEXT PRIMARY KEY, code TEXT, size INTEGER, submitted_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        count = self._conn.execute("SELECT COUNT(*) FROM submissions").fetchone()[0]
+        logger.info(f"已加载提交索引: {self.db_path} ({count} 条记录)")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def lookup(self, info_hash: str) -> tuple[str | None, int | None, float] | None:
+        """返回窗口期内的提交记录 (番号, 体积, 时间戳)，不存在时返回 None"""
+        if self._conn is None:
+            self.open()
+        row = self._conn.execute(
+            "SELECT code, size, submitted_at FROM submissions WHERE info_hash = ?", (info_hash,)
+        ).fetchone()
+        if row is None:
             return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"登录 Alist 获取 token 时出错: {str(e)}")
+        if DUPLICATE_WINDOW_DAYS and time.time() - row[2] > DUPLICATE_WINDOW_DAYS * 86400:
+            return None
+        return row
+
+    def record(self, info_hash: str, code: str | None, size: int | None) -> None:
+        if self._conn is None:
+            self.open()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO submissions (info_hash, code, size, submitted_at) VALUES (?, ?, ?, ?)",
+            (info_hash, code, size, time.time()),
+        )
+        self._conn.commit()
+
+    def remove(self, info_hashes) -> int:
+        """删除提交记录（下载失败后允许重新提交），返回删除条数"""
+        if self._conn is None:
+            self.open()
+        cursor = self._conn.executemany("DELETE FROM submissions WHERE info_hash = ?",
+                                        [(info_hash,) for info_hash in info_hashes])
+        self._conn.commit()
+        return cursor.rowcount
+
+
+submission_index = SubmissionIndex(os.path.join(BOT_DATA_DIR, "submissions.db"))
+
+MAGNET_REJECTED_MSG = "❌ 磁力解析失败"
+MAGNET_SERVER_REJECTED_MSG = "❌ 服务器拒绝请求（可能重复添加）"
+MAGNET_UNVERIFIED_MSG = "❌ 批量提交被拒绝，且无法核对已添加的任务，请在 Alist 中确认后重试"
+BTIH_REGEX = re.compile(r'xt=urn:btih:([A-Za-z0-9]+)', re.IGNORECASE)
+
+
+def extract_info_hash(magnet: str) -> str | None:
+    """从磁力链接中提取规范化的 info-hash（40 位小写十六进制，base32 形式会被转换）"""
+    match = BTIH_REGEX.search(magnet)
+    if not match:
         return None
-    except Exception as e:
-        logger.error(f"登录 Alist 过程中发生未知错误: {str(e)}", exc_info=True)
+    value = match.group(1)
+    if len(value) == 40 and re.fullmatch(r'[0-9A-Fa-f]{40}', value):
+        return value.lower()
+    if len(value) == 32:
+        try:
+            return base64.b32decode(value.upper()).hex()
+        except (binascii.Error, ValueError):
+            pass
+    return value.lower()
+
+
+def duplicate_message(info_hash: str | None) -> str | None:
+    """磁力在去重窗口内提交过时返回提示信息"""
+    if not info_hash:
         return None
+    try:
+        previous = submission_index.lookup(info_hash)
+    except sqlite3.Error as e:
+        logger.error(f"查询提交索引失败: {str(e)}")
+        return None
+    if previous:
+        submitted_at = datetime.fromtimestamp(previous[2]).strftime('%Y-%m-%d %H:%M')
+        return f"⚠️ 重复任务，已于 {submitted_at} 提交过"
+    return None
 
-async def add_magnet(context: ContextTypes.DEFAULT_TYPE, token: str, magnet: str) -> tuple[bool, str]:
-    """返回格式：(是否成功, 结果描述)"""
-    if not token or not magnet:
-        logger.error("添加任务失败: token 或磁力链接为空")
-        return False, "❌ 内部错误：必要参数缺失"
 
+def record_submission(info_hash: str | None, code: str | None, size_bytes: int | None) -> None:
+    if not info_hash:
+        return
+    try:
+        submission_index.record(info_hash, code, size_bytes)
+    except sqlite3.Error as e:
+        logger.error(f"写入提交索引失败: {str(e)}")
+
+
+async def post_offline_download(token: str, magnets: list[str]) -> tuple[bool, str]:
+    """一次 add_offline_download 请求提交多个磁力，返回格式：(是否成功, 结果描述)"""
     try:
-        url = BASE_URL.rstrip('/') + "/api/fs/add_offline_download"
-        headers = {
-            "Authorization": token,
-            "Content-Type": "application/json"
-        }
         post_data = {
             "path": OFFLINE_DOWNLOAD_DIR,
-            "urls": [magnet],
+            "urls": magnets,
             "tool": "storage",
             "delete_policy": "delete_on_upload_succeed"
         }
 
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(
-            None, lambda: requests.post(url, json=post_data, headers=headers, timeout=30))
+        response = await alist_client.post("/api/fs/add_offline_download", post_data, token, timeout=30)
 
         # 处理已知错误状态
-        if response.status_code == 401:
-            context.bot_data.pop("alist_token", None)
+        if is_unauthorized(response):
+            token_manager.invalidate()
             return False, "❌ 认证过期，请重试"
         if response.status_code == 500:
-            return False, "❌ 服务器拒绝请求（可能重复添加）"
+            return False, MAGNET_SERVER_REJECTED_MSG
 
         response.raise_for_status()
         result = response.json()
 
         if result.get("code") == 200:
+            task_tracker.wake()
             return True, "✅ 已添加至下载队列"
-        return False, f"❌ 磁力解析失败"
+        return False, MAGNET_REJECTED_MSG
 
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         return False, "⏳ 添加超时，请检查网络"
-    except requests.exceptions.ConnectionError:
+    except CircuitOpenError as e:
+        return False, f"🔌 Alist 暂时不可用（{e}）"
+    except httpx.TransportError:
         return False, "🔌 无法连接Alist服务"
     except Exception as e:
         logger.error(f"添加任务异常: {str(e)}")
         return False, f"❌ 意外错误: {str(e)[:50]}"
 
-async def recursive_collect_files(token: str, base_url: str, current_path: str) -> list[str]:
-    """递归收集目录下所有小文件（返回绝对路径）"""
-    if SIZE_THRESHOLD == 0:
-        return []
-    list_url = base_url.rstrip('/') + "/api/fs/list"
-    headers = {"Authorization": token, "Content-Type": "application/json"}
-    payload = {"path": current_path, "page": 1, "per_page": 0}
-    files = []
-
-    try:
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(
-            None, lambda: requests.post(list_url, json=payload, headers=headers, timeout=20)
-        )
-        response.raise_for_status()
-        list_result = response.json()
 
-        # 防御性数据解析
-        data = list_result.get("data") or {}
-        if list_result.get("code") != 200:
-            logger.error(f"目录列表失败: {list_result.get('message')} (路径: {current_path})")
-            return []
-
-        content = data.get("content") or []
-        if not isinstance(content, list):
-            logger.error(f"无效的API响应格式 (路径: {current_path})")
-            return []
+async def add_magnet(token: str, magnet: str,
+                     code: str | None = None, size_bytes: int | None = None) -> tuple[bool, str]:
+    """返回格式：(是否成功, 结果描述)"""
+    if not token or not magnet:
+        logger.error("添加任务失败: token 或磁力链接为空")
+        return False, "❌ 内部错误：必要参数缺失"
 
-        for item in content:
-            # 关键路径处理逻辑
-            try:
-                is_dir = item.get("is_dir", False)
-                file_name = item.get("name", "").strip()
-                file_size = item.get("size", 0)
+    info_hash = extract_info_hash(magnet)
+    duplicate = duplicate_message(info_hash)
+    if duplicate:
+        return False, duplicate
+
+    success, msg = await post_offline_download(token, [magnet])
+    if success:
+        record_submission(info_hash, code, size_bytes)
+    return success, msg
+
+
+async def add_magnets_bulk(token: str, items: list[dict]) -> list[tuple[bool, str]]:
+    """按 SUBMIT_CHUNK_SIZE 分块批量提交磁力（items 含 magnet/code/size_bytes），返回与 items 一一对应的结果。
+    整块被拒绝时二分拆块，定位出被拒绝的磁力，其余磁力照常提交"""
+    results: list[tuple[bool, str] | None] = [None] * len(items)
+    pending = []
+    for i, item in enumerate(items):
+        duplicate = duplicate_message(extract_info_hash(item["magnet"]))
+        if duplicate:
+            results[i] = (False, duplicate)
+        else:
+            pending.append(i)
+
+    def accept(indexes: list[int], msg: str) -> None:
+        for i in indexes:
+            record_submission(extract_info_hash(items[i]["magnet"]), items[i]["code"], items[i]["size_bytes"])
+            results[i] = (True, msg)
+
+    async def submit(indexes: list[int], known_ids: set[str] | None) -> None:
+        for attempt in range(SUBMIT_RETRIES + 1):
+            success, msg = await post_offline_download(token, [items[i]["magnet"] for i in indexes])
+            if success or not msg.startswith(SUBMIT_TRANSIENT_ERRORS) or attempt == SUBMIT_RETRIES:
+                break
+            await asyncio.sleep(backoff_delay(attempt))
+        if success:
+            accept(indexes, msg)
+            return
+        if len(indexes) == 1 or msg not in (MAGNET_REJECTED_MSG, MAGNET_SERVER_REJECTED_MSG):
+            # 单个磁力被拒绝，或超时/认证等与具体磁力无关的错误：整块记为失败
+            for i in indexes:
+                results[i] = (False, msg)
+            return
 
-                if not file_name:
-                    continue
+        # Alist 逐个添加 URL，遇到无效磁力即返回错误，排在它前面的磁力已经入队。
+        # 拆块重试前先核对任务列表，已入队的磁力不再重复提交
+        queued = await task_tracker.queued_info_hashes(token, known_ids)
+        if queued is None:
+            for i in indexes:
+                results[i] = (False, MAGNET_UNVERIFIED_MSG)
+            return
+        accepted = [i for i in indexes if extract_info_hash(items[i]["magnet"]) in queued]
+        rest = [i for i in indexes if i not in accepted]
+        if accepted:
+            accept(accepted, "✅ 已添加至下载队列")
+            task_tracker.wake()
+            if rest:
+                # 已入队的是前缀，剩余的第一个磁力即被拒绝的那个
+                await submit(rest[:1], known_ids)
+                if len(rest) > 1:
+                    await submit(rest[1:], known_ids)
+            return
+        mid = len(indexes) // 2
+        await submit(indexes[:mid], known_ids)
+        await submit(indexes[mid:], known_ids)
 
-                # 构建标准化绝对路径（兼容Windows/Linux）
-                full_path = "/".join([current_path.rstrip("/"), file_name.lstrip("/")])
+    chunk_size = max(1, SUBMIT_CHUNK_SIZE)
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        # 多个磁力的块可能部分入队：提交前记录已有任务 ID，被拒绝时据此识别本次新加入的任务
+        # （历史任务中同一磁力的旧记录不会被误认为已入队）
+        known_ids = await task_tracker.task_ids(token) if len(chunk) > 1 else None
+        await submit(chunk, known_ids)
+    return results
 
-                if is_dir:
-                    # 递归处理目录
-                    sub_files = await recursive_collect_files(token, base_url, full_path)
-                    files.extend(sub_files)
-                else:
-                    # 只收集小于阈值文件
-                    if file_size < SIZE_THRESHOLD:
-                        files.append(full_path)
-                        logger.debug(f"找到候选文件: {full_path} ({file_size/1024/1024:.2f} MB)")
 
-            except Exception as e:
-                logger.error(f"处理文件项时出错: {str(e)}", exc_info=True)
-                continue
+def join_alist_path(parent: str, name: str) -> str:
+    """构建标准化绝对路径（兼容Windows/Linux）"""
+    return "/".join([parent.rstrip("/"), name.lstrip("/")])
 
-        return files
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"网络请求失败: {str(e)} (路径: {current_path})")
-        return []
-    except Exception as e:
-        logger.error(f"未知错误: {str(e)} (路径: {current_path})", exc_info=True)
-        return []
+class ListDirectoryError(Exception):
+    """目录列表请求失败"""
 
-async def recursive_collect_empty_dirs(token: str, base_url: str, current_path: str) -> list[str]:
-    """递归收集目录下所有空文件夹（返回绝对路径）"""
-    list_url = base_url.rstrip('/') + "/api/fs/list"
-    headers = {"Authorization": token, "Content-Type": "application/json"}
-    payload = {"path": current_path, "page": 1, "per_page": 0}
-    empty_dirs = []
 
-    try:
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(
-            None, lambda: requests.post(list_url, json=payload, headers=headers, timeout=20)
-        )
-        response.raise_for_status()
-        list_result = response.json()
+async def iter_directory(token: str, path: str, per_page: int = LIST_PAGE_SIZE):
+    """分页列出单个目录，逐条产出条目（内存中只保留当前页）；失败时抛出 ListDirectoryError"""
+    page = 1
+    while True:
+        payload = {"path": path, "page": page, "per_page": per_page}
+        try:
+            response = await alist_client.post("/api/fs/list", payload, token, timeout=20)
+            response.raise_for_status()
+            list_result = response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"网络请求失败: {str(e)} (路径: {path})")
+            raise ListDirectoryError(str(e)) from e
+        except ValueError as e:
+            logger.error(f"无效的API响应格式 (路径: {path})")
+            raise ListDirectoryError(str(e)) from e
 
         # 防御性数据解析
-        data = list_result.get("data") or {}
         if list_result.get("code") != 200:
-            logger.error(f"目录列表失败: {list_result.get('message')} (路径: {current_path})")
-            return []
+            logger.error(f"目录列表失败: {list_result.get('message')} (路径: {path})")
+            raise ListDirectoryError(list_result.get("message") or "未知错误")
 
+        data = list_result.get("data") or {}
         content = data.get("content") or []
         if not isinstance(content, list):
-            logger.error(f"无效的API响应格式 (路径: {current_path})")
-            return []
-
-        sub_dirs = []
+            logger.error(f"无效的API响应格式 (路径: {path})")
+            raise ListDirectoryError("无效的API响应格式")
         for item in content:
-            is_dir = item.get("is_dir", False)
-            file_name = item.get("name", "").strip()
-            if not file_name:
-                continue
-            full_path = "/".join([current_path.rstrip("/"), file_name.lstrip("/")])
-            if is_dir:
-                sub_dirs.append(full_path)
-        for sub_dir in sub_dirs:
-            sub_empty_dirs = await recursive_collect_empty_dirs(token, base_url, sub_dir)
-            empty_dirs.extend(sub_empty_dirs)
+            yield item
 
-        if not sub_dirs and not any(not item.get("is_dir", False) for item in content):
-            empty_dirs.append(current_path)
+        total = data.get("total") or 0
+        if per_page <= 0 or len(content) < per_page or page * per_page >= total:
+            return
+        page += 1
+
+
+@dataclass
+class DirNode:
+    """遍历得到的单个目录：直接包含的文件及子目录"""
+    path: str
+    files: dict[str, int] = field(default_factory=dict)  # 文件名 -> 大小
+    subdirs: dict[str, str] = field(default_factory=dict)  # 子目录名 -> modified
+    complete: bool = True  # 条目数超限时为 False，此时不能据此判断目录为空
+    modified: str = ""  # 本目录在上级目录列表中的 modified
+
+
+@dataclass
+class WalkResult:
+    """一次目录树遍历的结果"""
+    small_files: list[str] = field(default_factory=list)
+    empty_dirs: list[str] = field(default_factory=list)
+    nodes: dict[str, DirNode] = field(default_factory=dict)
+    failed_dirs: list[str] = field(default_factory=list)
+    entry_count: int = 0
+    truncated: bool = False
+    listed: set[str] = field(default_factory=set)  # 本次实际请求列表的目录（其余复用快照）
+
+
+class DirSnapshot:
+    """目录快照（SQLite）：记录每个目录的 modified 与直接子项，供增量遍历复用未变化的目录"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.nodes: dict[str, DirNode] = {}
+        self.last_full_scan: float = 0.0
+        self._conn: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        if self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            " path TEXT PRIMARY KEY, modified TEXT NOT NULL, files TEXT NOT NULL, subdirs TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        for path, modified, files, subdirs in self._conn.execute("SELECT path, modified, files, subdirs FROM dirs"):
+            self.nodes[path] = DirNode(path, json.loads(files), json.loads(subdirs), modified=modified)
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'last_full_scan'").fetchone()
+        self.last_full_scan = float(row[0]) if row else 0.0
+        logger.info(f"已加载目录快照: {len(self.nodes)} 个目录")
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def reusable(self, path: str, modified: str) -> DirNode | None:
+        """modified 未变化且未被标记为脏的目录可直接复用快照"""
+        node = self.nodes.get(path)
+        if node is None or not modified or node.modified != modified:
+            return None
+        return node
+
+    def invalidate(self, paths) -> None:
+        """标记目录已变化（删除快照记录），下次遍历时会重新列出"""
+        if self._conn is None:
+            self.open()
+        stale = [path for path in paths if path in self.nodes]
+        for path in stale:
+            del self.nodes[path]
+        if stale:
+            with self._conn:
+                self._conn.executemany("DELETE FROM dirs WHERE path = ?", [(path,) for path in stale])
+
+    def invalidate_tree(self, roots) -> None:
+        """标记目录及其所有子目录已变化（新下载写入时父目录的 modified 不一定更新）"""
+        prefixes = tuple(root.rstrip('/') + '/' for root in roots)
+        self.invalidate([path for path in self.nodes
+                         if path.startswith(prefixes) or path + '/' in prefixes])
+
+    def update(self, root: str, walk: WalkResult, full_scan: bool) -> None:
+        """写入本次重新列出的目录，并移除 root 下已不存在的目录"""
+        if self._conn is None:
+            self.open()
+        changed = [walk.nodes[path] for path in walk.listed if walk.nodes[path].complete]
+        removed = []
+        if not walk.truncated and not walk.failed_dirs:
+            prefix = root.rstrip('/') + '/'
+            removed = [path for path in self.nodes
+                       if (path == root or path.startswith(prefix)) and path not in walk.nodes]
+        for node in changed:
+            self.nodes[node.path] = node
+        for path in removed:
+            del self.nodes[path]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dirs (path, modified, files, subdirs) VALUES (?, ?, ?, ?)",
+                [(node.path, node.modified, json.dumps(node.files, ensure_ascii=False),
+                  json.dumps(node.subdirs, ensure_ascii=False)) for node in changed],
+            )
+            self._conn.executemany("DELETE FROM dirs WHERE path = ?", [(path,) for path in removed])
+            if full_scan and root.rstrip('/') == OFFLINE_DOWNLOAD_DIR.rstrip('/'):
+                self.last_full_scan = time.time()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES ('last_full_scan', ?)", (str(self.last_full_scan),)
+                )
+
+    def full_scan_due(self) -> bool:
+        return time.time() - self.last_full_scan >= CLEAN_FULL_SCAN_HOURS * 3600
+
+
+dir_snapshot = DirSnapshot(os.path.join(BOT_DATA_DIR, "snapshot.db"))
+
+
+async def walk_directory_tree(token: str, root: str, max_depth: int = WALK_MAX_DEPTH,
+                              max_entries: int = WALK_MAX_ENTRIES,
+                              snapshot: DirSnapshot | None = None) -> WalkResult:
+    """并发遍历目录树，一次遍历同时收集小文件和空文件夹（返回绝对路径）。
+    传入 snapshot 时为增量遍历：modified 未变化的子目录直接复用快照，不再请求列表"""
+    return await walk_directory_trees(token, [root], max_depth, max_entries, snapshot)
+
+
+def merge_target_dirs(paths) -> list[str]:
+    """去重并去掉已被其他目标目录包含的子目录"""
+    merged: list[str] = []
+    for path in sorted({p.rstrip('/') or '/' for p in paths}):
+        if not any(path == m or path.startswith(m.rstrip('/') + '/') for m in merged):
+            merged.append(path)
+    return merged
+
+
+async def walk_directory_trees(token: str, roots: list[str], max_depth: int = WALK_MAX_DEPTH,
+                               max_entries: int = WALK_MAX_ENTRIES,
+                               snapshot: DirSnapshot | None = None) -> WalkResult:
+    """同一个工作协程池内并发遍历多个目录树，结果合并到一个 WalkResult"""
+    result = WalkResult()
+    queue: asyncio.Queue[tuple[str, int, str]] = asyncio.Queue()
+    for root in roots:
+        queue.put_nowait((root, 0, ""))
+
+    def handle_node(path: str, depth: int, node: DirNode) -> None:
+        for file_name, file_size in node.files.items():
+            # 只收集小于阈值文件
+            if SIZE_THRESHOLD and file_size < SIZE_THRESHOLD:
+                full_path = join_alist_path(path, file_name)
+                result.small_files.append(full_path)
+                logger.debug(f"找到候选文件: {full_path} ({file_size/1024/1024:.2f} MB)")
+        for dir_name, modified in node.subdirs.items():
+            if depth < max_depth:
+                queue.put_nowait((join_alist_path(path, dir_name), depth + 1, modified))
+            else:
+                result.truncated = True
 
-        return empty_dirs
+        result.nodes[path] = node
+        if (node.complete and not node.files and not node.subdirs
+                and path.rstrip('/') != OFFLINE_DOWNLOAD_DIR.rstrip('/')):
+            result.empty_dirs.append(path)
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"网络请求失败: {str(e)} (路径: {current_path})")
-        return []
+    async def list_into_node(path: str, depth: int, modified: str) -> None:
+        """逐页消费目录列表，直接累加到 DirNode（分页间重复返回的条目按名称去重）"""
+        node = DirNode(path, modified=modified)
+        try:
+            async for item in iter_directory(token, path):
+                try:
+                    file_name = (item.get("name") or "").strip()
+                    if not file_name or file_name in node.files or file_name in node.subdirs:
+                        continue
+                    if result.entry_count >= max_entries:
+                        result.truncated = True
+                        node.complete = False
+                        break
+                    result.entry_count += 1
+
+                    if item.get("is_dir", False):
+                        node.subdirs[file_name] = item.get("modified", "")
+                    else:
+                        node.files[file_name] = item.get("size", 0) or 0
+                except Exception as e:
+                    logger.error(f"处理文件项时出错: {str(e)}", exc_info=True)
+        except ListDirectoryError:
+            result.failed_dirs.append(path)
+            return
+        result.listed.add(path)
+        if node.complete:
+            directory_index.observe(path, node.subdirs)
+        handle_node(path, depth, node)
+
+    async def worker() -> None:
+        while True:
+            path, depth, modified = await queue.get()
+            try:
+                cached = snapshot.reusable(path, modified) if snapshot and depth > 0 else None
+                if cached is not None:
+                    result.entry_count += len(cached.files) + len(cached.subdirs)
+                    handle_node(path, depth, cached)
+                    continue
+                await list_into_node(path, depth, modified)
+            except Exception as e:
+                logger.error(f"未知错误: {str(e)} (路径: {path})", exc_info=True)
+                result.failed_dirs.append(path)
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, WALK_CONCURRENCY))]
+    try:
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    root = ", ".join(roots)
+    if result.truncated:
+        logger.warning(f"目录遍历达到限制 (深度 {max_depth} / 条目 {max_entries})，结果不完整: {root}")
+    logger.info(
+        f"遍历完成: {root} — {len(result.nodes)} 个目录 (实际列出 {len(result.listed)} 个), "
+        f"{len(result.small_files)} 个小文件, {len(result.empty_dirs)} 个空文件夹"
+    )
+    return result
+
+
+def plan_empty_dirs(walk: WalkResult, deleted_files: set[str]) -> list[str]:
+    """根据遍历结果推算删除 deleted_files 后会变空的目录（由深到浅排序）"""
+    will_be_empty: set[str] = set()
+    ordered = []
+    for path in sorted(walk.nodes, key=lambda p: p.count('/'), reverse=True):
+        node = walk.nodes[path]
+        if not node.complete or path.rstrip('/') == OFFLINE_DOWNLOAD_DIR.rstrip('/'):
+            continue
+        if any(join_alist_path(path, name) not in deleted_files for name in node.files):
+            continue
+        # 未成功列出的子目录不在 nodes 中，视为非空
+        if all(join_alist_path(path, name) in will_be_empty for name in node.subdirs):
+            will_be_empty.add(path)
+            ordered.append(path)
+    return ordered
+
+
+async def remove_names(token: str, parent_dir: str, names: list[str]) -> str | None:
+    """调用 /api/fs/remove 批量删除同一目录下的条目，成功返回 None，失败返回错误信息"""
+    try:
+        response = await alist_client.post(
+            "/api/fs/remove", {"dir": parent_dir, "names": names}, token, timeout=30
+        )
+        response.raise_for_status()
+        result = response.json()
+        if result.get("code") == 200:
+            return None
+        return result.get("message", "未知错误")
+    except httpx.HTTPError:
+        return "网络错误"
     except Exception as e:
-        logger.error(f"未知错误: {str(e)} (路径: {current_path})", exc_info=True)
-        return []
+        return str(e)
 
 
-async def cleanup_empty_dirs(token: str, base_url: str, target_dir: str) -> tuple[int, str]:
-    """清理空文件夹并返回成功删除的文件夹数+结果信息"""
+async def remove_names_with_retry(token: str, parent_dir: str, names: list[str]) -> dict[str, str]:
+    """批量删除并重试；整批仍失败时逐个删除以定位失败项。返回 {名称: 错误信息}"""
+    error = None
+    for attempt in range(REMOVE_RETRIES + 1):
+        error = await remove_names(token, parent_dir, names)
+        if error is None:
+            return {}
+        if attempt < REMOVE_RETRIES:
+            await asyncio.sleep(backoff_delay(attempt, base=0.5))
+    if len(names) == 1:
+        return {names[0]: error}
+
+    failures = {}
+    for name in names:
+        single_error = await remove_names(token, parent_dir, [name])
+        if single_error is not None:
+            failures[name] = single_error
+    return failures
+
+
+async def cleanup_empty_dirs(token: str, empty_dirs: list[str]) -> tuple[int, str]:
+    """按父目录分组批量删除空文件夹（由深到浅），返回成功删除的文件夹数+结果信息"""
+    from collections import defaultdict
+
     try:
-        empty_dirs = await recursive_collect_empty_dirs(token, base_url, target_dir)
         if not empty_dirs:
             return 0, "✅ 未找到空文件夹"
 
+        # 按深度分层，同层内按父目录分组
+        levels: dict[int, dict[str, list[str]]] = defaultdict(lambda: defaultdict(list))
+        for dir_path in empty_dirs:
+            levels[dir_path.rstrip('/').count('/')][os.path.dirname(dir_path)].append(os.path.basename(dir_path))
+
         total_deleted = 0
         error_messages = []
-        for dir_path in empty_dirs:
-            try:
-                remove_url = base_url.rstrip('/') + "/api/fs/remove"
-                headers = {"Authorization": token, "Content-Type": "application/json"}
-                delete_payload = {
-                    "dir": os.path.dirname(dir_path),
-                    "names": [os.path.basename(dir_path)]
-                }
-                response = requests.post(remove_url, json=delete_payload, headers=headers, timeout=30)
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("code") == 200:
-                        total_deleted += 1
-                        logger.debug(f"成功删除空文件夹: {dir_path}")
-                    else:
-                        error_msg = result.get("message", "未知错误")
-                        error_messages.append(f"文件夹 {os.path.basename(dir_path)}: {error_msg}")
-                else:
-                    response.raise_for_status()
-            except requests.exceptions.RequestException as e:
-                error_messages.append(f"文件夹 {os.path.basename(dir_path)}: 网络错误")
-            except Exception as e:
-                error_messages.append(f"文件夹 {os.path.basename(dir_path)}: {str(e)}")
+        failed_paths: list[str] = []
+        for depth in sorted(levels, reverse=True):
+            groups = {}
+            for parent_dir, names in levels[depth].items():
+                # 子目录删除失败时，其上层目录不再为空，跳过
+                names = [n for n in names
+                         if not any(f.startswith(join_alist_path(parent_dir, n) + '/') for f in failed_paths)]
+                if names:
+                    groups[parent_dir] = names
+            outcomes = await asyncio.gather(
+                *(remove_names_with_retry(token, parent_dir, names) for parent_dir, names in groups.items())
+            )
+            for (parent_dir, names), failures in zip(groups.items(), outcomes):
+                total_deleted += len(names) - len(failures)
+                directory_index.removed(parent_dir, [n for n in names if n not in failures])
+                for name, error_msg in failures.items():
+                    failed_paths.append(join_alist_path(parent_dir, name))
+                    error_messages.append(f"文件夹 {name}: {error_msg}")
+                logger.debug(f"成功删除 {len(names) - len(failures)} 个空文件夹于 {parent_dir}")
 
         if error_messages:
             return total_deleted, (
@@ -462,110 +1563,332 @@ async def cleanup_empty_dirs(token: str, base_url: str, target_dir: str) -> tupl
         return 0, f"❌ 系统错误: {str(e)}"
 
 
-async def cleanup_small_files(token: str, base_url: str, target_dir: str) -> tuple[int, str]:
-    if SIZE_THRESHOLD == 0:
-        return 0, "✅ 小文件清理功能未启用"
+@dataclass
+class CleanupResult:
+    """一次清理（可包含多个目标目录）的汇总结果"""
+    walk: WalkResult
+    deleted_paths: set[str] = field(default_factory=set)  # 已删除文件的绝对路径
+    deleted_dirs: int = 0
+    file_errors: list[str] = field(default_factory=list)
+    dir_msg: str = ""
+
+    @property
+    def deleted_files(self) -> int:
+        return len(self.deleted_paths)
+
+
+def format_bytes(size: int) -> str:
+    """字节数格式化为易读的单位"""
+    value = float(size)
+    for unit in ("B", "KB", "MB", "GB"):
+        if value < 1024:
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+@dataclass
+class CleanupPlan:
+    """一次遍历得到的清理计划：待删除的小文件（按父目录分组）及其体积，可直接执行而无需再次遍历"""
+    roots: list[str]
+    walk: WalkResult
+    files: dict[str, dict[str, int]] = field(default_factory=dict)  # 父目录 -> {文件名: 大小}
+    matches: dict[str, list[str]] | None = None  # 按番号清理时的 {番号: 目录列表}
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def total_files(self) -> int:
+        return sum(len(names) for names in self.files.values())
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(sum(names.values()) for names in self.files.values())
+
+    def empty_dirs(self) -> list[str]:
+        """全部小文件删除后会变空的文件夹"""
+        deleted = {join_alist_path(parent, name) for parent, names in self.files.items() for name in names}
+        return plan_empty_dirs(self.walk, deleted)
+
+    def by_extension(self) -> list[tuple[str, int, int]]:
+        """按扩展名统计 [(扩展名, 文件数, 字节数)]，按字节数降序"""
+        stats: dict[str, list[int]] = {}
+        for names in self.files.values():
+            for name, size in names.items():
+                ext = os.path.splitext(name)[1].lower() or "(无扩展名)"
+                entry = stats.setdefault(ext, [0, 0])
+                entry[0] += 1
+                entry[1] += size
+        return sorted(((ext, n, b) for ext, (n, b) in stats.items()), key=lambda x: x[2], reverse=True)
+
+    def by_folder(self) -> list[tuple[str, int, int]]:
+        """按下载根目录下的一级文件夹（即每个下载任务）统计 [(文件夹, 文件数, 字节数)]，按字节数降序"""
+        prefix = OFFLINE_DOWNLOAD_DIR.rstrip('/') + '/'
+        stats: dict[str, list[int]] = {}
+        for parent, names in self.files.items():
+            folder = parent
+            if parent.startswith(prefix):
+                folder = prefix + parent[len(prefix):].split('/', 1)[0]
+            entry = stats.setdefault(folder, [0, 0])
+            entry[0] += len(names)
+            entry[1] += sum(names.values())
+        return sorted(((f, n, b) for f, (n, b) in stats.items()), key=lambda x: x[2], reverse=True)
+
+    def expired(self) -> bool:
+        return time.time() - self.created_at > CLEAN_PLAN_TTL
+
+
+async def plan_cleanup(token: str, roots: list[str], incremental: bool = False) -> CleanupPlan:
+    """遍历所有目标目录并生成清理计划（不删除任何内容）"""
+    roots = merge_target_dirs(roots)
+    full_scan = not incremental or dir_snapshot.full_scan_due()
+    logger.info(f"开始清理目录: {', '.join(roots)} ({'完整' if full_scan else '增量'}遍历)")
+    walk = await walk_directory_trees(token, roots, snapshot=None if full_scan else dir_snapshot)
     try:
-        from collections import defaultdict
-        import os
-        from urllib.parse import quote
-
-        logger.info(f"开始清理目录: {target_dir}")
-        files_to_delete = await recursive_collect_files(token, base_url, target_dir)
+        for root in roots:
+            dir_snapshot.update(root, walk, full_scan)
+    except sqlite3.Error as e:
+        logger.error(f"写入目录快照失败: {str(e)}")
+
+    plan = CleanupPlan(roots, walk)
+    for abs_path in walk.small_files:
+        parent_dir, file_name = os.path.dirname(abs_path), os.path.basename(abs_path)
+        plan.files.setdefault(parent_dir, {})[file_name] = walk.nodes[parent_dir].files.get(file_name, 0)
+    return plan
+
+
+async def apply_cleanup_plan(token: str, plan: CleanupPlan) -> CleanupResult:
+    """按计划分组批量删除小文件，再删除因此变空的文件夹"""
+    walk = plan.walk
+    result = CleanupResult(walk)
+    if not walk.small_files and not walk.empty_dirs:
+        return result
+
+    # 按父目录分组的删除请求并发发出
+    dir_files = {parent_dir: list(names) for parent_dir, names in plan.files.items()}
+    outcomes = await asyncio.gather(
+        *(remove_names_with_retry(token, parent_dir, names) for parent_dir, names in dir_files.items())
+    )
+    for (parent_dir, file_names), failures in zip(dir_files.items(), outcomes):
+        deleted = [name for name in file_names if name not in failures]
+        result.deleted_paths.update(join_alist_path(parent_dir, name) for name in deleted)
+        logger.debug(f"成功删除 {len(deleted)} 个文件于 {parent_dir}")
+        for name, error_msg in failures.items():
+            result.file_errors.append(f"目录 {os.path.basename(parent_dir)}: {name} - {error_msg}")
+
+    # 无需重新遍历：根据同一次遍历结果推算删除后变空的文件夹，再由深到浅删除
+    empty_dirs = plan_empty_dirs(walk, result.deleted_paths)
+    result.deleted_dirs, result.dir_msg = await cleanup_empty_dirs(token, empty_dirs)
+
+    # 有删除操作的目录内容已变化，下次增量遍历时重新列出
+    touched = set(dir_files) | {os.path.dirname(path) for path in empty_dirs} | set(empty_dirs)
+    try:
+        dir_snapshot.invalidate(touched)
+    except sqlite3.Error as e:
+        logger.error(f"更新目录快照失败: {str(e)}")
+    return result
 
-        if not files_to_delete:
-            return 0, "✅ 未找到小于指定大小的文件"
 
-        # 按父目录分组文件
-        dir_files = defaultdict(list)
-        for abs_path in files_to_delete:
-            parent_dir = os.path.dirname(abs_path)
-            file_name = os.path.basename(abs_path)
-            dir_files[parent_dir].append(file_name)
+async def run_cleanup(token: str, roots: list[str], incremental: bool = False) -> CleanupResult:
+    """一次遍历所有目标目录，按父目录分组批量删除小文件，再删除因此变空的文件夹"""
+    return await apply_cleanup_plan(token, await plan_cleanup(token, roots, incremental))
 
-        total_deleted_files = 0
-        file_error_messages = []
 
-        # 分目录批量删除
-        for parent_dir, file_names in dir_files.items():
-            try:
-                remove_url = base_url.rstrip('/') + "/api/fs/remove"
-                headers = {"Authorization": token, "Content-Type": "application/json"}
-
-                # URL编码处理（兼容特殊字符）
-                encoded_dir = quote(parent_dir, safe='')
-                encoded_names = [quote(name, safe='') for name in file_names]
-
-                delete_payload = {
-                    "dir": parent_dir,
-                    "names": file_names
-                }
-
-                response = requests.post(remove_url, json=delete_payload, headers=headers, timeout=30)
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if result.get("code") == 200:
-                        deleted = len(file_names)
-                        total_deleted_files += deleted
-                        logger.debug(f"成功删除 {deleted} 个文件于 {parent_dir}")
-                    else:
-                        # 记录更详细的错误信息
-                        error_msg = f"目录 {os.path.basename(parent_dir)}: API 返回错误码 {result.get('code')}，消息: {result.get('message')}"
-                        file_error_messages.append(error_msg)
-                else:
-                    response.raise_for_status()
-
-            except requests.exceptions.RequestException as e:
-                error_msg = f"目录 {os.path.basename(parent_dir)}: 网络错误 - {str(e)}"
-                file_error_messages.append(error_msg)
-            except Exception as e:
-                error_msg = f"目录 {os.path.basename(parent_dir)}: {str(e)}"
-                file_error_messages.append(error_msg)
-
-        # 清理完小文件后，继续清理空文件夹
-        total_deleted_dirs, dir_msg = await cleanup_empty_dirs(token, base_url, target_dir)
-
-        # 生成结果信息
-        if file_error_messages and total_deleted_files == 0 and total_deleted_dirs == 0:
-            return 0, (
-                f"❌ 部分删除失败 (成功 0 个文件和 0 个空文件夹)\n"
-                f"错误({min(len(file_error_messages), 3)}/{len(file_error_messages)}):\n" +
-                "\n".join([f"• {msg}" for msg in file_error_messages[:3]])
-            )
+def format_cleanup_plan(plan: CleanupPlan) -> str:
+    """生成清理计划预览：可释放的文件数与体积，按扩展名和文件夹分类"""
+    empty_dirs = plan.empty_dirs()
+    lines = [
+        "📋 清理计划（仅预览，未删除任何文件）",
+        "━━━━━━━━━━━━━━━",
+        f"将删除 {plan.total_files} 个小文件，共 {format_bytes(plan.total_bytes)}；{len(empty_dirs)} 个空文件夹",
+    ]
+    if plan.files:
+        lines.append("按扩展名:")
+        lines.extend(f"• {ext}: {n} 个，{format_bytes(b)}" for ext, n, b in plan.by_extension()[:8])
+        folders = plan.by_folder()
+        lines.append("按文件夹:")
+        lines.extend(f"• {os.path.basename(f) or f}: {n} 个，{format_bytes(b)}" for f, n, b in folders[:8])
+        if len(folders) > 8:
+            lines.append(f"（仅显示前8个，共{len(folders)}个文件夹）")
+    if plan.walk.failed_dirs or plan.walk.truncated:
+        lines.append(f"⚠️ 遍历不完整（{len(plan.walk.failed_dirs)} 个目录列表失败），实际可清理的可能更多")
+    lines.append("━━━━━━━━━━━━━━━")
+    lines.append(f"阈值: {format_bytes(SIZE_THRESHOLD)} | {CLEAN_PLAN_TTL // 60} 分钟内发送 /clean apply 按此计划执行")
+    return "\n".join(lines)
+
+
+def format_cleanup_result(result: CleanupResult) -> tuple[int, str]:
+    """生成单目录清理结果信息，返回 (删除的文件数, 结果描述)"""
+    if not result.walk.small_files and not result.walk.empty_dirs:
+        return 0, "✅ 未找到小于指定大小的文件"
+
+    total_deleted_files = result.deleted_files
+    total_deleted_dirs = result.deleted_dirs
+    file_error_messages = result.file_errors
+    dir_msg = result.dir_msg
+
+    # 生成结果信息
+    if file_error_messages and total_deleted_files == 0 and total_deleted_dirs == 0:
+        return 0, (
+            f"❌ 部分删除失败 (成功 0 个文件和 0 个空文件夹)\n"
+            f"错误({min(len(file_error_messages), 3)}/{len(file_error_messages)}):\n" +
+            "\n".join([f"• {msg}" for msg in file_error_messages[:3]])
+        )
 
-        if total_deleted_files > 0 or total_deleted_dirs > 0:
-            if total_deleted_dirs > 0:
-                if file_error_messages:
-                    return total_deleted_files, (
-                        f"✅ 部分文件删除失败，但成功删除 {total_deleted_files} 个文件和 {total_deleted_dirs} 个空文件夹\n"
-                        f"文件删除错误({min(len(file_error_messages), 3)}/{len(file_error_messages)}):\n" +
-                        "\n".join([f"• {msg}" for msg in file_error_messages[:3]])
-                    )
-                else:
-                    return total_deleted_files, f"✅ 成功删除 {total_deleted_files} 个文件和 {total_deleted_dirs} 个空文件夹"
+    if total_deleted_files > 0 or total_deleted_dirs > 0:
+        if total_deleted_dirs > 0:
+            if file_error_messages:
+                return total_deleted_files, (
+                    f"✅ 部分文件删除失败，但成功删除 {total_deleted_files} 个文件和 {total_deleted_dirs} 个空文件夹\n"
+                    f"文件删除错误({min(len(file_error_messages), 3)}/{len(file_error_messages)}):\n" +
+                    "\n".join([f"• {msg}" for msg in file_error_messages[:3]])
+                )
             else:
-                if file_error_messages:
-                    return total_deleted_files, (
-                        f"✅ 部分文件删除失败，但成功删除 {total_deleted_files} 个文件\n"
-                        f"文件删除错误({min(len(file_error_messages), 3)}/{len(file_error_messages)}):\n" +
-                        "\n".join([f"• {msg}" for msg in file_error_messages[:3]])
-                    )
-                else:
-                    return total_deleted_files, f"✅ 成功删除 {total_deleted_files} 个文件。{dir_msg}"
+                return total_deleted_files, f"✅ 成功删除 {total_deleted_files} 个文件和 {total_deleted_dirs} 个空文件夹"
         else:
-            return 0, f"✅ 未找到小于指定大小的文件，{dir_msg}"
+            if file_error_messages:
+                return total_deleted_files, (
+                    f"✅ 部分文件删除失败，但成功删除 {total_deleted_files} 个文件\n"
+                    f"文件删除错误({min(len(file_error_messages), 3)}/{len(file_error_messages)}):\n" +
+                    "\n".join([f"• {msg}" for msg in file_error_messages[:3]])
+                )
+            else:
+                return total_deleted_files, f"✅ 成功删除 {total_deleted_files} 个文件。{dir_msg}"
+    else:
+        return 0, f"✅ 未找到小于指定大小的文件，{dir_msg}"
 
+
+async def cleanup_small_files(token: str, target_dir: str, incremental: bool = False,
+                              dry_run: bool = False) -> tuple[int, str]:
+    """清理小文件及由此产生的空文件夹；incremental=True 时只重新列出快照中发生变化的目录。
+    dry_run=True 时只生成计划，返回 (将删除的文件数, 计划预览)"""
+    if SIZE_THRESHOLD == 0:
+        return 0, "✅ 小文件清理功能未启用"
+    try:
+        plan = await plan_cleanup(token, [target_dir], incremental)
+        if dry_run:
+            return plan.total_files, format_cleanup_plan(plan)
+        return format_cleanup_result(await apply_cleanup_plan(token, plan))
     except Exception as e:
         logger.error(f"清理异常: {str(e)}", exc_info=True)
         return 0, f"❌ 系统错误: {str(e)}"
 
 
-async def find_download_directory(token: str, base_url: str, parent_dir: str, original_code: str) -> tuple[list[str] | None, str | None]:
+NON_ALNUM_REGEX = re.compile(r'[^a-zA-Z0-9]')
+
+
+def normalize_dir_name(name: str) -> str:
+    """目录名/番号标准化：去掉非字母数字字符并转小写"""
+    return NON_ALNUM_REGEX.sub('', name).lower()
+
+
+class NameIndex:
+    """单个目录下子目录的标准化名称索引（有序数组），前缀查询为对数时间"""
+
+    def __init__(self, names=()):
+        pairs = sorted((normalize_dir_name(name), name) for name in names)
+        self.keys = [key for key, _ in pairs]
+        self.names = [name for _, name in pairs]
+        self.built_at = time.time()
+
+    def remove(self, name: str) -> None:
+        key = normalize_dir_name(name)
+        pos = bisect.bisect_left(self.keys, key)
+        while pos < len(self.keys) and self.keys[pos] == key:
+            if self.names[pos] == name:
+                del self.keys[pos]
+                del self.names[pos]
+                return
+            pos += 1
+
+    def prefix(self, pattern: str) -> list[str]:
+        """返回标准化名称以 pattern 开头的子目录名"""
+        lo = bisect.bisect_left(self.keys, pattern)
+        hi = bisect.bisect_left(self.keys, pattern + '\uffff', lo)
+        return self.names[lo:hi]
+
+
+class DirectoryIndex:
+    """按父目录缓存 NameIndex；遍历与删除时增量更新，新下载完成时标记过期"""
+
+    def __init__(self):
+        self._indexes: dict[str, NameIndex] = {}
+
+    @staticmethod
+    def _key(parent_dir: str) -> str:
+        parent_dir = parent_dir.strip().replace('\\', '/').rstrip('/')
+        return parent_dir if parent_dir.startswith('/') else f'/{parent_dir}'
+
+    def observe(self, parent_dir: str, subdir_names) -> None:
+        """遍历时拿到了完整列表，直接重建已缓存的索引"""
+        key = self._key(parent_dir)
+        if key in self._indexes:
+            self._indexes[key] = NameIndex(subdir_names)
+
+    def removed(self, parent_dir: str, names) -> None:
+        index = self._indexes.get(self._key(parent_dir))
+        if index is not None:
+            for name in names:
+                index.remove(name)
+
+    def invalidate(self, parent_dir: str) -> None:
+        self._indexes.pop(self._key(parent_dir), None)
+
+    async def get(self, token: str, parent_dir: str,
+                  max_age: float = DIR_INDEX_TTL) -> tuple[NameIndex | None, str | None]:
+        key = self._key(parent_dir)
+        index = self._indexes.get(key)
+        if index is not None and time.time() - index.built_at < max_age:
+            return index, None
+        # 逐页读取，只保留目录名
+        names = set()
+        try:
+            async for item in iter_directory(token, key):
+                if item.get("is_dir") and (name := (item.get("name") or "").strip()):
+                    names.add(name)
+        except ListDirectoryError as e:
+            return None, f"目录列表失败: {str(e)}"
+        index = self._indexes[key] = NameIndex(names)
+        return index, None
+
+
+    async def match(self, token: str, parent_dir: str,
+                    codes: list[str]) -> tuple[dict[str, list[str]] | None, str | None]:
+        """按番号前缀查找子目录名，返回 {番号: 目录名列表}。
+        有番号未命中且索引不是刚建立的，重新列出目录再查一次（新建的下载目录不会增量进入索引）"""
+        index, error = await self.get(token, parent_dir)
+        if index is None:
+            return None, error
+        matches = {code: index.prefix(normalize_dir_name(code)) for code in codes}
+        if all(matches.values()) or time.time() - index.built_at < DIR_INDEX_FRESH_SECONDS:
+            return matches, None
+        index, error = await self.get(token, parent_dir, max_age=0)
+        if index is None:
+            return None, error
+        return {code: index.prefix(normalize_dir_name(code)) for code in codes}, None
+
+
+directory_index = DirectoryIndex()
+
+
+async def find_download_directories(token: str, parent_dir: str,
+                                    codes: list[str]) -> tuple[dict[str, list[str]] | None, str | None]:
+    """一次性为多个番号查找匹配目录，返回 {番号: 目录列表}"""
+    parent_dir = parent_dir.strip().replace('\\', '/').rstrip('/')
+    if not parent_dir.startswith('/'):
+        parent_dir = f'/{parent_dir}'
+    try:
+        matches, error = await directory_index.match(token, parent_dir, codes)
+    except Exception as e:
+        logger.error(f"目录搜索异常: {str(e)}")
+        return None, f"目录搜索失败: {str(e)}"
+    if matches is None:
+        return None, error
+    return {code: [join_alist_path(parent_dir, name) for name in names] for code, names in matches.items()}, None
+
+
+async def find_download_directory(token: str, parent_dir: str, original_code: str) -> tuple[list[str] | None, str | None]:
     """返回所有匹配的目录列表"""
     logger.info(f"在目录 '{parent_dir}' 中搜索番号 '{original_code}'...")
-    list_url = base_url.rstrip('/') + "/api/fs/list"
-    headers = {"Authorization": token, "Content-Type": "application/json"}
 
     try:
         # 路径标准化处理
@@ -573,26 +1896,15 @@ async def find_download_directory(token: str, base_url: str, parent_dir: str, or
         if not parent_dir.startswith('/'):
             parent_dir = f'/{parent_dir}'
 
-        list_payload = {"path": parent_dir, "page": 1, "per_page": 0}
-        response = requests.post(list_url, json=list_payload, headers=headers, timeout=20)
-        response.raise_for_status()
-        list_result = response.json()
+        matches, error = await directory_index.match(token, parent_dir, [original_code])
+        if matches is None:
+            return None, error
 
-        if list_result.get("code") != 200:
-            return None, f"目录列表失败: {list_result.get('message', '未知错误')}"
-
-        content = list_result.get("data", {}).get("content", [])
-        target_pattern = re.sub(r'[^a-zA-Z0-9]', '', original_code).lower()
         possible_matches = []
-
-        for item in content:
-            if item.get("is_dir"):
-                dir_name = item.get("name", "").strip()
-                normalized_dir = re.sub(r'[^a-zA-Z0-9]', '', dir_name).lower()
-                if normalized_dir.startswith(target_pattern):
-                    full_path = f"{parent_dir.rstrip('/')}/{dir_name}".replace('//', '/')
-                    possible_matches.append(full_path)
-                    logger.debug(f"找到候选目录: {full_path}")
+        for dir_name in matches[original_code]:
+            full_path = f"{parent_dir.rstrip('/')}/{dir_name}".replace('//', '/')
+            possible_matches.append(full_path)
+            logger.debug(f"找到候选目录: {full_path}")
 
         return possible_matches, None
 
@@ -625,15 +1937,96 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         '1. 直接发送番号（例如：`ABC-123`, `IPX-888`）\n'
         '2. 直接发送磁力链接（以 `magnet:?` 开头）\n\n'
         '3. 清理功能：\n'
-        '   - `/clean <番号>` 清理该番号对应的下载目录\n'
-        '   - `/clean /` 递归清理所有下载目录（谨慎使用！）\n\n'
+        '   - `/clean <番号> [番号...]` 清理这些番号对应的下载目录\n'
+        '   - `/clean /` 递归清理所有下载目录（谨慎使用！）\n'
+        '   - `/clean plan <番号|/>` 只预览将删除的文件与体积，随后 `/clean apply` 执行该计划\n\n'
         '4. 刷新功能：\n'
         '   - `/refresh` 刷新 Alist 文件列表\n\n'
+        '5. 任务队列：\n'
+        '   - `/jobs` 查看批量任务队列，`/jobs <批次号>` 查看明细\n'
+        '   - `/status` 查看后台任务、清理积压与缓存状态\n\n'
         f'当前配置的下载根目录: `{OFFLINE_DOWNLOAD_DIR}`',
         parse_mode='Markdown'
     )
 
 
+def retry_after_seconds(error: RetryAfter) -> float:
+    """兼容 retry_after 为秒数或 timedelta 的不同版本"""
+    delay = error.retry_after
+    return delay.total_seconds() if isinstance(delay, timedelta) else float(delay)
+
+
+class ProgressReporter:
+    """节流的进度消息：合并更新、每条消息最多每 N 秒编辑一次、跳过未变化文本并遵守 RetryAfter"""
+
+    def __init__(self, message, interval: float = PROGRESS_EDIT_INTERVAL):
+        self.message = message
+        self.interval = interval
+        self._last_text = getattr(message, "text", None)
+        self._pending: str | None = None
+        self._next_edit = 0.0  # 节流：下一次允许编辑的时间
+        self._blocked_until = 0.0  # RetryAfter：Telegram 要求的等待截止时间
+        self._task: asyncio.Task | None = None
+
+    def update(self, text: str) -> None:
+        """登记最新进度文本（立即返回，由后台任务按节奏发送）"""
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._pending is not None:
+            wait = max(self._next_edit, self._blocked_until) - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            text, self._pending = self._pending, None
+            if text is not None and text != self._last_text:
+                await self._edit(text)
+
+    async def _edit(self, text: str) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            await self.message.edit_text(text)
+            self._last_text = text
+            return True
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            logger.warning(f"Telegram 限流，{delay:.0f} 秒后再更新进度")
+            self._blocked_until = loop.time() + delay
+            if self._pending is None:
+                self._pending = text
+            return False
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._last_text = text
+                return True
+            logger.debug(f"更新进度消息失败: {str(e)}")
+            return False
+        except TelegramError as e:
+            logger.debug(f"更新进度消息失败: {str(e)}")
+            return False
+        finally:
+            self._next_edit = loop.time() + self.interval
+
+    async def finish(self, text: str, attempts: int = 3) -> None:
+        """停止节流更新并发送最终文本（遇到 RetryAfter 时等待后重试）"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._pending = None
+        if text == self._last_text:
+            return
+        loop = asyncio.get_running_loop()
+        for _ in range(attempts):
+            wait = self._blocked_until - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if await self._edit(text):
+                return
+            self._pending = None
+
+
 FANHAO_REGEX = re.compile(
     r'^[A-Za-z]{2,5}[-_ ]?\d{2,5}(?:[-_ ]?[A-Za-z])?$',
     re.IGNORECASE
@@ -643,30 +2036,27 @@ FANHAO_REGEX = re.compile(
 # 新增：处理单条输入的函数
 async def handle_single_entry(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str, entry: str):
     chat_id = update.effective_chat.id
-    loop = asyncio.get_event_loop()
     processing_msg = None
 
     try:
         if entry.startswith("magnet:?"):
             logger.info(f"收到磁力链接: {entry[:50]}...")
             processing_msg = await update.message.reply_text("🔗 收到磁力链接，准备添加...")
-            success, result_msg = await add_magnet(context, token, entry)
+            success, result_msg = await add_magnet(token, entry)
         elif FANHAO_REGEX.match(entry):
             logger.info(f"收到可能的番号: {entry}")
             processing_msg = await update.message.reply_text(f"🔍 正在搜索番号: {entry}...")
             await context.bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
 
-            # 同步函数转异步执行
-            magnet, error_msg = await loop.run_in_executor(
-                None, lambda: get_magnet(entry, SEARCH_URL)
-            )
+            found, error_msg = await get_magnet_entry(entry, SEARCH_URL)
 
-            if not magnet:
+            if not found:
                 await processing_msg.edit_text(f"❌ 搜索失败: {error_msg}")
                 return
 
             await processing_msg.edit_text(f"✅ 已找到磁力链接，正在添加到 Alist...")
-            success, result_msg = await add_magnet(context, token, magnet)
+            success, result_msg = await add_magnet(token, found["magnet"],
+                                                   code=entry, size_bytes=found["size_bytes"])
         else:
             await update.message.reply_text("无法识别的消息格式。请发送番号（如 ABC-123）或磁力链接。")
             return
@@ -677,8 +2067,7 @@ async def handle_single_entry(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text(result_msg)
 
         if success:
-            await asyncio.sleep(3)
-            await refresh_command(update, context)
+            refresh_scheduler.request()
 
     except Exception as e:
         logger.error(f"处理异常: {str(e)}", exc_info=True)
@@ -689,68 +2078,515 @@ async def handle_single_entry(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text(error_msg)
 
 
-# 新增：处理批量输入的函数
-async def handle_batch_entries(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str, entries: list[str]):
-    chat_id = update.effective_chat.id
-    loop = asyncio.get_running_loop()
-    progress_msg = await update.message.reply_text(f"🔄 开始批量处理 {len(entries)} 个任务...")
-    results = []
-    BATCH_DELAY = 0.8
+def dedupe_batch_entries(entries: list[str]) -> tuple[list[str], dict[str, list[str]]]:
+    """按规范化 info-hash / 番号合并重复输入（不发起任何网络请求），返回 (保留条目, {保留条目: 被合并的行})"""
+    unique = []
+    merged: dict[str, list[str]] = {}
+    seen: dict[str, str] = {}
+    for entry in entries:
+        if entry.startswith("magnet:?"):
+            info_hash = extract_info_hash(entry)
+            key = f"btih:{info_hash}" if info_hash else entry
+        elif FANHAO_REGEX.match(entry):
+            key = f"code:{normalize_fanhao(entry)}"
+        else:
+            key = entry
+        if key in seen:
+            merged.setdefault(seen[key], []).append(entry)
+        else:
+            seen[key] = entry
+            unique.append(entry)
+    return unique, merged
+
+
+@dataclass
+class EntryOutcome:
+    """批量条目的处理结果"""
+    success: bool
+    message: str
+    merged_into: str | None = None  # 与其他条目解析到同一磁力时，记录保留的条目
+    info_hash: str | None = None
+
+
+# 可重试的错误（超时、服务异常、连接失败），其余错误重试也不会改变结果
+SEARCH_TRANSIENT_ERRORS = ("⏳", "🔍 搜索服务异常", "🔍 搜索时发生意外错误")
+SUBMIT_TRANSIENT_ERRORS = ("⏳", "🔌")
+
+
+@dataclass
+class ResolvedEntry:
+    """搜索阶段的产出：待提交的候选磁力（按优先级排列）"""
+    job: sqlite3.Row
+    candidates: list[dict]
+
+
+async def resolve_batch_entry(entry: str) -> tuple[list[dict] | None, str | None]:
+    """搜索阶段：把条目解析为候选磁力列表，超时/服务异常时退避重试"""
+    if entry.startswith("magnet:?"):
+        return [{"magnet": entry, "size_bytes": None, "code": None}], None
+    if not FANHAO_REGEX.match(entry):
+        return None, "格式错误"
+    for attempt in range(SEARCH_RETRIES + 1):
+        candidates, error = await get_magnet_candidates(entry, SEARCH_URL, RANK_TOP_N)
+        if candidates:
+            return [dict(found, code=entry) for found in candidates], None
+        if not (error or "").startswith(SEARCH_TRANSIENT_ERRORS) or attempt == SEARCH_RETRIES:
+            break
+        await asyncio.sleep(backoff_delay(attempt))
+    return None, f"搜索失败: {error}"
+
+
+async def submit_batch_chunk(token: str, resolved: list[ResolvedEntry], claimed_hashes_for,
+                             on_resolved=None) -> list[EntryOutcome]:
+    """提交阶段：一组条目的首选磁力合并为批量请求提交；被 Alist 拒绝的条目换下一个候选再提交。
+    与其他条目解析到同一磁力时标记为合并"""
+    outcomes: list[EntryOutcome | None] = [None] * len(resolved)
+    active = [(i, 0) for i in range(len(resolved))]  # (条目序号, 当前候选序号)
+    while active:
+        submitting = []
+        for i, candidate_index in active:
+            entry = resolved[i].job["entry"]
+            found = resolved[i].candidates[candidate_index]
+            info_hash = extract_info_hash(found["magnet"])
+            if info_hash:
+                owner = claimed_hashes_for(resolved[i].job).setdefault(info_hash, entry)
+                if owner != entry:
+                    outcomes[i] = EntryOutcome(False, f"与 {owner} 为同一磁力", merged_into=owner, info_hash=info_hash)
+                    continue
+            if on_resolved:
+                on_resolved(resolved[i].job, info_hash)
+            submitting.append((i, candidate_index, info_hash))
+
+        results = await add_magnets_bulk(token, [resolved[i].candidates[c] for i, c, _ in submitting])
+        active = []
+        for (i, candidate_index, info_hash), (success, msg) in zip(submitting, results):
+            if msg == MAGNET_REJECTED_MSG and candidate_index + 1 < len(resolved[i].candidates):
+                active.append((i, candidate_index + 1))
+            else:
+                outcomes[i] = EntryOutcome(success, msg, info_hash=info_hash)
+    return outcomes
+
+
+# --- 持久化任务队列 ---
+JOB_PENDING = "pending"
+JOB_SEARCHING = "searching"
+JOB_SUBMITTED = "submitted"
+JOB_FAILED = "failed"
+JOB_MERGED = "merged"
+JOB_STATE_LABELS = {
+    JOB_PENDING: "⏸ 等待中",
+    JOB_SEARCHING: "🔍 处理中",
+    JOB_SUBMITTED: "🟢 已提交",
+    JOB_FAILED: "🔴 失败",
+    JOB_MERGED: "🔁 已合并",
+}
+JOB_UNFINISHED_STATES = (JOB_PENDING, JOB_SEARCHING)
+
+
+class JobStore:
+    """批量离线下载任务的本地持久化存储（SQLite），重启后可继续处理未完成任务"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        if self._conn is not None:
+            return
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, batch_id TEXT NOT NULL, chat_id INTEGER NOT NULL,"
+            " position INTEGER NOT NULL, entry TEXT NOT NULL, state TEXT NOT NULL, result TEXT,"
+            " info_hash TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, position)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self._conn.commit()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def add_batch(self, chat_id: int, entries: list[str]) -> tuple[str, list[int]]:
+        batch_id = uuid.uuid4().hex[:8]
+        now = time.time()
+        job_ids = []
+        with self._conn:
+            for position, entry in enumerate(entries):
+                cursor = self._conn.execute(
+                    "INSERT INTO jobs (batch_id, chat_id, position, entry, state, created_at, updated_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (batch_id, chat_id, position, entry, JOB_PENDING, now, now),
+                )
+                job_ids.append(cursor.lastrowid)
+        return batch_id, job_ids
+
+    def get(self, job_id: int) -> sqlite3.Row | None:
+        return self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def update(self, job_id: int, **fields) -> None:
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def unfinished(self) -> list[sqlite3.Row]:
+        return self._conn.execute(
+            "SELECT * FROM jobs WHERE state IN (?, ?) ORDER BY id", JOB_UNFINISHED_STATES
+        ).fetchall()
+
+    def batch(self, batch_id: str) -> list[sqlite3.Row]:
+        return self._conn.execute(
+            "SELECT * FROM jobs WHERE batch_id = ? ORDER BY position", (batch_id,)
+        ).fetchall()
+
+    def state_counts(self) -> dict[str, int]:
+        rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+    def recent_batches(self, limit: int = 5) -> list[sqlite3.Row]:
+        return self._conn.execute(
+            "SELECT batch_id, MIN(created_at) AS created_at, COUNT(*) AS total,"
+            " SUM(state IN ('pending', 'searching')) AS unfinished,"
+            " SUM(state = 'submitted') AS submitted, SUM(state = 'failed') AS failed"
+            " FROM jobs GROUP BY batch_id ORDER BY created_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+
+    def purge(self, older_than_days: int) -> int:
+        if older_than_days <= 0:
+            return 0
+        cutoff = time.time() - older_than_days * 86400
+        with self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE updated_at < ? AND state NOT IN (?, ?)",
+                (cutoff, *JOB_UNFINISHED_STATES),
+            )
+        return cursor.rowcount
+
+
+class OfflineJobQueue:
+    """持久化任务队列：消息处理函数入队，后台两级流水线消费（搜索阶段提前解析番号写入有界缓冲区，
+    提交阶段从缓冲区取出提交）；启动时恢复未完成任务"""
+
+    def __init__(self, store: JobStore):
+        self.store = store
+        self.application: Application | None = None
+        self._queue: asyncio.Queue[int] = asyncio.Queue()
+        self._buffer: asyncio.Queue[ResolvedEntry] = asyncio.Queue(maxsize=max(1, PIPELINE_BUFFER_SIZE))
+        self._workers: list[asyncio.Task] = []
+        self._claims: dict[str, dict[str, str]] = {}
+        self._events: dict[str, asyncio.Event] = {}
+        self._watched: set[str] = set()
+        self._watchers: set[asyncio.Task] = set()  # 后台汇报批次进度的任务
+        self._searching = 0  # 正在搜索（含等待放入缓冲区）的条目数
+        self._gather_lock = asyncio.Lock()  # 同一时间只有一个提交协程在凑块，避免条目被分散到多个小块
+
+    async def start(self, application: Application) -> None:
+        self.application = application
+        self.store.open()
+        purged = self.store.purge(JOB_RETENTION_DAYS)
+        if purged:
+            logger.info(f"已清理 {purged} 条过期任务记录")
+        # 恢复上次未完成的任务（处理中的任务重置为等待状态后重新执行）
+        unfinished = self.store.unfinished()
+        for job in unfinished:
+            if job["state"] != JOB_PENDING:
+                self.store.update(job["id"], state=JOB_PENDING)
+            self._queue.put_nowait(job["id"])
+        if unfinished:
+            logger.info(f"已恢复 {len(unfinished)} 个未完成的任务")
+        self._workers = (
+            [asyncio.create_task(self._search_worker()) for _ in range(max(1, SEARCH_CONCURRENCY))]
+            + [asyncio.create_task(self._submit_worker()) for _ in range(max(1, SUBMIT_CONCURRENCY))]
+        )
 
-    for idx, entry in enumerate(entries, 1):
+    async def stop(self) -> None:
+        tasks = [*self._watchers, *self._workers]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self.store.close()
+
+    def spawn_watcher(self, coro) -> None:
+        """在后台运行批次进度汇报或结果推送，保留任务引用，停止时统一取消（未完成的批次重启后另行通知）"""
+        task = asyncio.create_task(coro)
+        self._watchers.add(task)
+        task.add_done_callback(self._watchers.discard)
+
+    def enqueue_batch(self, chat_id: int, entries: list[str]) -> str:
+        batch_id, job_ids = self.store.add_batch(chat_id, entries)
+        self._events[batch_id] = asyncio.Event()
+        self._watched.add(batch_id)  # 由调用方通过 watch() 跟踪进度并汇报结果
+        for job_id in job_ids:
+            self._queue.put_nowait(job_id)
+        return batch_id
+
+    def progress(self, batch_id: str) -> tuple[int, int, int, int]:
+        """返回 (已完成, 总数, 成功, 失败)，合并的条目不计入成功/失败"""
+        rows = self.store.batch(batch_id)
+        done = sum(1 for row in rows if row["state"] not in JOB_UNFINISHED_STATES)
+        success = sum(1 for row in rows if row["state"] == JOB_SUBMITTED)
+        failure = sum(1 for row in rows if row["state"] == JOB_FAILED)
+        return done, len(rows), success, failure
+
+    async def watch(self, batch_id: str):
+        """逐次产出批量进度，直到该批次全部完成"""
+        event = self._events.setdefault(batch_id, asyncio.Event())
         try:
-            # 更新进度消息
-            success_count = sum(1 for res in results if res[1])
-            await progress_msg.edit_text(
-                f"⏳ 处理进度: {idx}/{len(entries)}\n"
-                f"当前项: {entry[:15]}...\n"
-                f"成功: {success_count} 失败: {len(results)-success_count}"
-            )
+            while True:
+                progress = self.progress(batch_id)
+                yield progress
+                if progress[0] >= progress[1]:
+                    return
+                await event.wait()
+                event.clear()
+        finally:
+            self._watched.discard(batch_id)
+            self._events.pop(batch_id, None)
+            self._claims.pop(batch_id, None)
+
+    def _claims_for(self, batch_id: str) -> dict[str, str]:
+        """本批次已占用的 info-hash（重启后根据存储重建）"""
+        claims = self._claims.get(batch_id)
+        if claims is None:
+            claims = self._claims[batch_id] = {}
+            for row in self.store.batch(batch_id):
+                if row["entry"].startswith("magnet:?"):
+                    info_hash = extract_info_hash(row["entry"])
+                    if info_hash:
+                        claims.setdefault(info_hash, row["entry"])
+                elif row["info_hash"] and row["state"] != JOB_MERGED:
+                    claims.setdefault(row["info_hash"], row["entry"])
+        return claims
+
+    async def _search_worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            self._searching += 1
+            try:
+                resolved = await self._resolve(job_id)
+                if resolved is not None:
+                    # 缓冲区满时在此等待，搜索阶段最多领先提交阶段 PIPELINE_BUFFER_SIZE 条
+                    await self._buffer.put(resolved)
+            except Exception as e:
+                logger.error(f"任务 {job_id} 处理异常: {str(e)}", exc_info=True)
+                self.store.update(job_id, state=JOB_FAILED, result=f"处理异常: {str(e)[:50]}")
+            finally:
+                self._searching -= 1
+                self._queue.task_done()
+
+    async def _submit_worker(self) -> None:
+        while True:
+            # 凑够 SUBMIT_CHUNK_SIZE 个条目、等待超过 SUBMIT_BATCH_WINDOW 或搜索全部结束时合并提交
+            async with self._gather_lock:
+                chunk = [await self._buffer.get()]
+                deadline = time.monotonic() + SUBMIT_BATCH_WINDOW
+                while len(chunk) < max(1, SUBMIT_CHUNK_SIZE):
+                    try:
+                        chunk.append(self._buffer.get_nowait())
+                        continue
+                    except asyncio.QueueEmpty:
+                        pass
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or (self._queue.empty() and not self._searching):
+                        break
+                    try:
+                        chunk.append(await asyncio.wait_for(self._buffer.get(), timeout=min(remaining, 0.2)))
+                    except asyncio.TimeoutError:
+                        pass
+            try:
+                await self._submit(chunk)
+            except Exception as e:
+                logger.error(f"批量提交异常: {str(e)}", exc_info=True)
+                for resolved in chunk:
+                    self._finish(resolved.job, EntryOutcome(False, f"处理异常: {str(e)[:50]}"))
+            finally:
+                for _ in chunk:
+                    self._buffer.task_done()
+
+    async def _resolve(self, job_id: int) -> ResolvedEntry | None:
+        """搜索阶段：返回待提交的条目；无需提交（已完成/失败）时返回 None"""
+        job = self.store.get(job_id)
+        if job is None or job["state"] not in JOB_UNFINISHED_STATES:
+            return None
+        self.store.update(job_id, attempts=job["attempts"] + 1)
+
+        # 幂等恢复：上次已提交成功（索引中有记录）但未来得及更新状态的任务不再重复提交
+        if job["attempts"] and job["info_hash"]:
+            previous = submission_index.lookup(job["info_hash"])
+            if previous and previous[2] >= job["created_at"]:
+                self._finish(job, EntryOutcome(True, "✅ 已添加至下载队列", info_hash=job["info_hash"]))
+                return None
+
+        self.store.update(job_id, state=JOB_SEARCHING)
+        candidates, error = await resolve_batch_entry(job["entry"])
+        if not candidates:
+            self._finish(job, EntryOutcome(False, error))
+            return None
+        return ResolvedEntry(job, candidates)
 
-            # 处理逻辑
-            if entry.startswith("magnet:?"):
-                success, msg = await add_magnet(context, token, entry)
-                results.append((entry, success, msg))
-            elif FANHAO_REGEX.match(entry):
-                magnet, error = await loop.run_in_executor(None, lambda: get_magnet(entry, SEARCH_URL))
-                if magnet:
-                    success, msg = await add_magnet(context, token, magnet)
-                    results.append((entry, success, msg))
-                else:
-                    results.append((entry, False, f"搜索失败: {error}"))
+    async def _submit(self, chunk: list[ResolvedEntry]) -> None:
+        token = await token_manager.get()
+        if not token:
+            for resolved in chunk:
+                self._finish(resolved.job, EntryOutcome(False, "❌ 无法登录 Alist"))
+            return
+        outcomes = await submit_batch_chunk(
+            token, chunk, lambda job: self._claims_for(job["batch_id"]),
+            on_resolved=lambda job, info_hash: self.store.update(job["id"], info_hash=info_hash),
+        )
+        for resolved, outcome in zip(chunk, outcomes):
+            self._finish(resolved.job, outcome)
+
+    def _finish(self, job: sqlite3.Row, outcome: EntryOutcome) -> None:
+        if outcome.merged_into:
+            state, result = JOB_MERGED, outcome.merged_into
+        else:
+            state, result = (JOB_SUBMITTED if outcome.success else JOB_FAILED), outcome.message
+        self.store.update(job["id"], state=state, result=result, info_hash=outcome.info_hash)
+
+        batch_id = job["batch_id"]
+        event = self._events.get(batch_id)
+        if event:
+            event.set()
+        if batch_id not in self._watched:
+            done, total, success, _ = self.progress(batch_id)
+            if done >= total:
+                # 无人等待的批次（重启后恢复的任务）：完成后主动推送结果
+                self._claims.pop(batch_id, None)
+                self.spawn_watcher(self._notify_resumed(job["chat_id"], batch_id, success))
+
+    async def _notify_resumed(self, chat_id: int, batch_id: str, success_count: int) -> None:
+        results, merged = self.batch_results(batch_id)
+        text = f"♻️ 重启前的批量任务 {batch_id} 已恢复完成\n" + build_batch_report(results, merged)
+        try:
+            await self.application.bot.send_message(chat_id=chat_id, text=text)
+        except TelegramError as e:
+            logger.error(f"推送恢复任务结果失败: {str(e)}")
+        if success_count > 0:
+            refresh_scheduler.request()
+
+    def batch_results(self, batch_id: str) -> tuple[list[tuple[str, bool, str]], dict[str, list[str]]]:
+        """返回批次结果 [(条目, 是否成功, 结果描述)] 与合并信息 {保留条目: [被合并的行]}"""
+        results = []
+        merged: dict[str, list[str]] = {}
+        for row in self.store.batch(batch_id):
+            if row["state"] == JOB_MERGED:
+                merged.setdefault(row["result"], []).append(row["entry"])
             else:
-                results.append((entry, False, "格式错误"))
+                results.append((row["entry"], row["state"] == JOB_SUBMITTED, row["result"] or ""))
+        return results, merged
 
-            await asyncio.sleep(BATCH_DELAY)
 
-        except Exception as e:
-            logger.error(f"批量处理异常: {entry} - {str(e)}")
-            results.append((entry, False, f"处理异常: {str(e)[:50]}"))
-            await asyncio.sleep(BATCH_DELAY * 2)
+job_queue = OfflineJobQueue(JobStore(os.path.join(BOT_DATA_DIR, "jobs.db")))
+
 
-    # 生成统计报告
+def build_batch_report(results: list[tuple[str, bool, str]], merged: dict[str, list[str]]) -> str:
+    """生成批量处理统计报告（被合并的条目不单独计数）"""
     success_count = sum(1 for res in results if res[1])
     report = [
-        f"✅ 批量处理完成 ({success_count}/{len(entries)})",
+        f"✅ 批量处理完成 ({success_count}/{len(results)})",
         "━━━━━━━━━━━━━━━",
         *[f"{'🟢' if res[1] else '🔴'} {res[0][:20]}... | {res[2][:30]}"
           for res in results[:10]],  # 显示前10条结果
         "━━━━━━━━━━━━━━━",
-        f"成功: {success_count} 条 | 失败: {len(entries)-success_count} 条"
+        f"成功: {success_count} 条 | 失败: {len(results)-success_count} 条"
     ]
     if len(results) > 10:
-        report.insert(3, f"（仅显示前10条结果，共{len(entries)}条）")
+        report.insert(3, f"（仅显示前10条结果，共{len(results)}条）")
+    if merged:
+        merged_lines = [(line, owner) for owner, lines in merged.items() for line in lines]
+        report.append(f"🔁 已合并重复输入 {len(merged_lines)} 条:")
+        report.extend(f"• {line[:20]}... → {owner[:20]}..." for line, owner in merged_lines[:5])
+    return "\n".join(report)
+
 
-    await progress_msg.edit_text("\n".join(report))
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="💡 提示：使用 /clean / 命令可以清理所有垃圾文件",
-        reply_to_message_id=progress_msg.message_id
+# 新增：处理批量输入的函数
+async def handle_batch_entries(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str, entries: list[str]):
+    chat_id = update.effective_chat.id
+    entries, merged = dedupe_batch_entries(entries)
+    # 先持久化再回复，确保进程重启后任务不会丢失
+    batch_id = job_queue.enqueue_batch(chat_id, entries)
+    progress_msg = await update.message.reply_text(
+        f"🔄 开始批量处理 {len(entries)} 个任务（批次 {batch_id}）...\n处理期间可使用 /jobs {batch_id} 查看明细"
     )
+    # 进度与结果在后台汇报，处理器立即返回，不阻塞 /jobs、/status 等其他命令
+    job_queue.spawn_watcher(report_batch(context.bot, chat_id, batch_id, progress_msg, merged))
+
+
+async def report_batch(bot, chat_id: int, batch_id: str, progress_msg, merged: dict[str, list[str]]) -> None:
+    """跟踪批次进度并在全部完成后发送统计报告"""
+    try:
+        progress = ProgressReporter(progress_msg)
+        async for done_count, total, success_count, failure_count in job_queue.watch(batch_id):
+            progress.update(
+                f"⏳ 处理进度: {done_count}/{total}\n"
+                f"成功: {success_count} 失败: {failure_count}"
+            )
+
+        results, merged_after_search = job_queue.batch_results(batch_id)
+        for owner, lines in merged_after_search.items():
+            merged.setdefault(owner, []).extend(lines)
+        success_count = sum(1 for res in results if res[1])
+
+        await progress.finish(build_batch_report(results, merged))
+        await bot.send_message(
+            chat_id=chat_id,
+            text="💡 提示：使用 /clean / 命令可以清理所有垃圾文件",
+            reply_to_message_id=progress_msg.message_id
+        )
+
+        if success_count > 0:
+            refresh_scheduler.request()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"汇报批次 {batch_id} 结果时出错: {str(e)}", exc_info=True)
+
+
+@restricted
+async def jobs_command(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str) -> None:
+    """查看持久化任务队列：/jobs 显示概况，/jobs <批次号> 显示批次明细"""
+    if context.args:
+        batch_id = context.args[0].strip()
+        rows = job_queue.store.batch(batch_id)
+        if not rows:
+            await update.message.reply_text(f"❌ 未找到批次 {batch_id}")
+            return
+        lines = [f"📋 批次 {batch_id}（共 {len(rows)} 条）", "━━━━━━━━━━━━━━━"]
+        lines.extend(
+            f"{JOB_STATE_LABELS.get(row['state'], row['state'])} {row['entry'][:20]}... | {(row['result'] or '')[:30]}"
+            for row in rows[:30]
+        )
+        if len(rows) > 30:
+            lines.append("（仅显示前30条）")
+        await update.message.reply_text("\n".join(lines))
+        return
 
-    if success_count > 0:
-        await asyncio.sleep(3)
-        await refresh_command(update, context)
+    counts = job_queue.store.state_counts()
+    lines = ["📋 任务队列概况", "━━━━━━━━━━━━━━━"]
+    lines.extend(f"{label}: {counts.get(state, 0)}" for state, label in JOB_STATE_LABELS.items())
+    batches = job_queue.store.recent_batches()
+    if batches:
+        lines.append("━━━━━━━━━━━━━━━")
+        lines.append("最近批次:")
+        for row in batches:
+            created = datetime.fromtimestamp(row["created_at"]).strftime('%m-%d %H:%M')
+            status = "进行中" if row["unfinished"] else "已完成"
+            lines.append(
+                f"• {row['batch_id']} {created} {status} "
+                f"({row['submitted']}✅ / {row['failed']}❌ / 共 {row['total']})"
+            )
+        lines.append("使用 /jobs <批次号> 查看明细")
+    await update.message.reply_text("\n".join(lines))
 
 
 @restricted
@@ -778,115 +2614,114 @@ async def clean_command(update: Update, context: ContextTypes.DEFAULT_TYPE, toke
         await update.message.reply_text("请提供清理参数：/clean <番号> 或 /clean /")
         return
 
-    target = context.args[0].strip()
+    mode = context.args[0].lower()
+    if mode == "apply":
+        await apply_clean_plan(update, context, token)
+        return
+    args = context.args[1:] if mode == "plan" else context.args
+    if not args:
+        await update.message.reply_text("请提供清理参数：/clean plan <番号> 或 /clean plan /")
+        return
+
+    target = " ".join(args).strip()
     chat_id = update.effective_chat.id
-    processing_msg = await update.message.reply_text(f"🧹 开始清理任务（目标: {target}）...")
+    processing_msg = await update.message.reply_text(
+        f"{'📋 开始生成清理计划' if mode == 'plan' else '🧹 开始清理任务'}（目标: {target}）..."
+    )
+    progress = ProgressReporter(processing_msg)
 
     try:
-        if target == "/":
+        if "/" in args:
             # 全目录清理逻辑
-            deleted_files, msg = await cleanup_small_files(token, BASE_URL, OFFLINE_DOWNLOAD_DIR)
-            final_text = f"全局清理完成\n{msg}"
-            await processing_msg.edit_text(final_text)
-            return
+            roots, matches = [OFFLINE_DOWNLOAD_DIR], None
+        else:
+            # 多个番号一次解析，合并重叠目录后共用一次遍历
+            codes = list(dict.fromkeys(arg.strip() for arg in args if arg.strip()))
+            matches, find_error = await find_download_directories(token, OFFLINE_DOWNLOAD_DIR, codes)
+            if matches is None:
+                await progress.finish(f"❌ 清理失败: {find_error}")
+                return
+            roots = merge_target_dirs(d for dirs in matches.values() for d in dirs)
+            if not roots:
+                await progress.finish(f"❌ 清理失败: 未找到 {' '.join(codes)} 对应的目录")
+                return
+            logger.info(f"找到 {len(roots)} 个匹配目录，开始批量清理...")
+
+        progress.update(f"🔍 正在遍历 {len(roots)} 个目录...")
+        async with cleanup_scheduler.lock:
+            plan = await plan_cleanup(token, roots)
+            plan.matches = matches
+            if mode == "plan":
+                # 缓存计划，随后的 /clean apply 直接执行，无需再次遍历
+                context.chat_data["clean_plan"] = plan
+                await progress.finish(format_cleanup_plan(plan))
+                return
+            progress.update(f"🧹 正在清理 {len(roots)} 个目录...")
+            result = await apply_cleanup_plan(token, plan)
+        await progress.finish(build_cleanup_summary(plan, result))
 
-        # 获取所有匹配目录
-        directories, find_error = await find_download_directory(token, BASE_URL, OFFLINE_DOWNLOAD_DIR, target)
-        if not directories:
-            await processing_msg.edit_text(f"❌ 清理失败: {find_error}")
-            return
+    except Exception as e:
+        logger.error(f"清理命令异常: {str(e)}", exc_info=True)
+        await progress.finish(f"❌ 清理过程中出现未知错误: {str(e)[:50]}")
 
-        logger.info(f"找到 {len(directories)} 个匹配目录，开始批量清理...")
 
-        success_dirs = 0
-        total_files = 0
-        total_dirs = len(directories)
-        error_messages = []
+async def apply_clean_plan(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str) -> None:
+    """执行本会话中最近一次 /clean plan 生成的计划"""
+    plan = context.chat_data.pop("clean_plan", None)
+    if plan is None or plan.expired():
+        await update.message.reply_text("❌ 没有可执行的清理计划（或已过期），请先发送 /clean plan <番号> 或 /clean plan /")
+        return
+    processing_msg = await update.message.reply_text(
+        f"🧹 按计划删除 {plan.total_files} 个小文件（{format_bytes(plan.total_bytes)}）..."
+    )
+    progress = ProgressReporter(processing_msg)
+    try:
+        async with cleanup_scheduler.lock:
+            result = await apply_cleanup_plan(token, plan)
+        await progress.finish(build_cleanup_summary(plan, result))
+    except Exception as e:
+        logger.error(f"清理命令异常: {str(e)}", exc_info=True)
+        await progress.finish(f"❌ 清理过程中出现未知错误: {str(e)[:50]}")
 
-        # 清理所有匹配目录
-        for idx, dir_path in enumerate(directories, 1):
-            await processing_msg.edit_text(
-                f"🧹 正在清理 ({idx}/{total_dirs}): {os.path.basename(dir_path)}..."
-            )
-            deleted, msg = await cleanup_small_files(token, BASE_URL, dir_path)
-            if deleted > 0:
-                success_dirs += 1
-                total_files += deleted
-            if '❌' in msg:
-                error_messages.append(msg)
-
-        # 生成最终报告
-        zero_dirs_count = total_dirs - success_dirs - len(error_messages)
-        if success_dirs > 0 and zero_dirs_count == 0 and len(error_messages) == 0:
-            final_text = (
-                f"✅ 清理完成！共清理 {total_files} 个小文件，涉及 {success_dirs} 个目录。"
-            )
-        elif success_dirs > 0 and zero_dirs_count == 0 and len(error_messages) > 0:
-            final_text = (
-                f"✅ 部分清理完成！成功清理 {total_files} 个小文件，涉及 {success_dirs} 个目录。\n"
-                f"❌ 以下目录清理失败 ({len(error_messages)}):\n" +
-                "\n".join([f"• {msg}" for msg in error_messages[:3]])
-            )
-        elif success_dirs > 0 and zero_dirs_count > 0 and len(error_messages) == 0:
-            final_text = (
-                f"✅ 部分清理完成！成功清理 {total_files} 个小文件，涉及 {success_dirs} 个目录。\n"
-                f"⚠️ 以下目录未找到需要清理的文件 ({zero_dirs_count}):\n" +
-                "\n".join([os.path.basename(d) for d in directories if d not in [d for _, msg in zip(directories, msg) if '✅' in msg]])
-            )
-        elif success_dirs > 0 and zero_dirs_count > 0 and len(error_messages) > 0:
-            final_text = (
-                f"✅ 部分清理完成！成功清理 {total_files} 个小文件，涉及 {success_dirs} 个目录。\n"
-                f"⚠️ 以下目录未找到需要清理的文件 ({zero_dirs_count}):\n" +
-                "\n".join([os.path.basename(d) for d in directories if d not in [d for _, msg in zip(directories, msg) if '✅' in msg]]) +
-                f"\n❌ 以下目录清理失败 ({len(error_messages)}):\n" +
-                "\n".join([f"• {msg}" for msg in error_messages[:3]])
-            )
-        elif success_dirs == 0 and zero_dirs_count == 0 and len(error_messages) > 0:
-            final_text = (
-                f"❌ 清理失败！未成功清理任何目录。\n" +
-                "\n".join([f"• {msg}" for msg in error_messages[:3]])
-            )
-        elif success_dirs == 0 and zero_dirs_count > 0 and len(error_messages) == 0:
-            final_text = (
-                f"⚠️ 所有目录均未找到需要清理的文件 ({total_dirs})。"
-            )
-        elif success_dirs == 0 and zero_dirs_count > 0 and len(error_messages) > 0:
-            final_text = (
-                f"❌ 清理失败！未成功清理任何目录。\n"
-                f"⚠️ 以下目录未找到需要清理的文件 ({zero_dirs_count}):\n" +
-                "\n".join([os.path.basename(d) for d in directories if d not in [d for _, msg in zip(directories, msg) if '✅' in msg]]) +
-                f"\n❌ 以下目录清理失败 ({len(error_messages)}):\n" +
-                "\n".join([f"• {msg}" for msg in error_messages[:3]])
-            )
-        else:
-            final_text = (
-                f"✅ 部分清理完成！成功清理 {total_files} 个小文件，涉及 {success_dirs} 个目录。"
-            )
 
-        await processing_msg.edit_text(final_text)
+def build_cleanup_summary(plan: CleanupPlan, result: CleanupResult) -> str:
+    if plan.matches is None:
+        return f"全局清理完成\n{format_cleanup_result(result)[1]}"
+    return build_clean_report(plan.matches, result)
 
-    except Exception as e:
-        logger.error(f"清理命令异常: {str(e)}", exc_info=True)
-        await processing_msg.edit_text(f"❌ 清理过程中出现未知错误: {str(e)[:50]}")
+
+def build_clean_report(matches: dict[str, list[str]], result: CleanupResult) -> str:
+    """生成多番号清理的汇总报告"""
+    lines = [
+        f"✅ 清理完成！共清理 {result.deleted_files} 个小文件，{result.deleted_dirs} 个空文件夹",
+        "━━━━━━━━━━━━━━━",
+    ]
+    for code, dirs in matches.items():
+        if not dirs:
+            lines.append(f"⚠️ {code}: 未找到匹配目录")
+            continue
+        prefixes = tuple(d.rstrip('/') + '/' for d in dirs)
+        deleted = sum(1 for path in result.deleted_paths if path.startswith(prefixes))
+        lines.append(f"{'🟢' if deleted else '⚪'} {code}: {len(dirs)} 个目录，清理 {deleted} 个小文件")
+    errors = result.file_errors + ([result.dir_msg] if result.dir_msg.startswith("❌") else [])
+    if result.walk.failed_dirs:
+        errors.append(f"{len(result.walk.failed_dirs)} 个目录列表失败")
+    if errors:
+        lines.append("━━━━━━━━━━━━━━━")
+        lines.append(f"❌ 错误({min(len(errors), 3)}/{len(errors)}):")
+        lines.extend(f"• {msg}" for msg in errors[:3])
+    return "\n".join(lines)
 
 
 @restricted
 async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE, *, token: str) -> None:
     """发送刷新请求以刷新 Alist"""
-    refresh_url = BASE_URL.rstrip('/') + "/api/fs/list"
-    headers = {
-        "Authorization": token,
-        "Content-Type": "application/json"
-    }
-    payload = {"path": "/", "page": 1, "per_page": 0}
+    payload = {"path": "/", "page": 1, "per_page": 1}  # 只需要触发列表请求，不使用返回内容
     chat_id = update.effective_chat.id
     processing_msg = await update.message.reply_text("🔄 正在刷新 Alist...")
 
     try:
-        loop = asyncio.get_running_loop()
-        response = await loop.run_in_executor(
-            None, lambda: requests.post(refresh_url, json=payload, headers=headers, timeout=30)
-        )
+        response = await alist_client.post("/api/fs/list", payload, token, timeout=30)
         response.raise_for_status()
         result = response.json()
 
@@ -896,7 +2731,7 @@ async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE, *,
             error_msg = result.get("message", "未知错误")
             await processing_msg.edit_text(f"❌ 刷新失败: {error_msg}")
 
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"刷新 Alist 时出错: {str(e)}")
         await processing_msg.edit_text(f"❌ 刷新失败: 网络错误 ({str(e)[:50]})")
     except Exception as e:
@@ -904,6 +2739,425 @@ async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE, *,
         await processing_msg.edit_text(f"❌ 刷新失败: 未知错误 ({str(e)[:50]})")
 
 
+# --- 后台刷新 ---
+class RefreshScheduler:
+    """合并多次提交触发的刷新请求，防抖后在后台对下载目录做一次带 refresh 的列表请求"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.refresh_count = 0
+        self._first_request: float | None = None
+        self._last_request: float | None = None
+        self._task: asyncio.Task | None = None
+
+    def request(self) -> None:
+        """登记一次刷新需求（立即返回，不阻塞调用方）"""
+        now = asyncio.get_running_loop().time()
+        self._last_request = now
+        if self._first_request is None:
+            self._first_request = now
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._first_request is not None:
+            deadline = min(self._last_request + REFRESH_DEBOUNCE_SECONDS,
+                           self._first_request + REFRESH_MAX_DELAY_SECONDS)
+            if loop.time() < deadline:
+                await asyncio.sleep(deadline - loop.time())
+                continue
+            self._first_request = self._last_request = None
+            await self._refresh()
+
+    async def _refresh(self) -> None:
+        token = await token_manager.get()
+        if not token:
+            logger.error("无法获取 Alist token，跳过后台刷新")
+            return
+        payload = {"path": self.path, "page": 1, "per_page": 1, "refresh": True}
+        try:
+            response = await alist_client.post("/api/fs/list", payload, token, timeout=30)
+            response.raise_for_status()
+            result = response.json()
+            if result.get("code") == 200:
+                self.refresh_count += 1
+                logger.info(f"已在后台刷新目录: {self.path}")
+            else:
+                logger.error(f"后台刷新失败: {result.get('message', '未知错误')}")
+        except httpx.HTTPError as e:
+            logger.error(f"后台刷新时出错: {str(e)}")
+        except Exception as e:
+            logger.error(f"后台刷新时发生未知错误: {str(e)}", exc_info=True)
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+        self._task = None
+
+
+refresh_scheduler = RefreshScheduler(OFFLINE_DOWNLOAD_DIR)
+
+
+# --- 离线任务跟踪 ---
+TASK_KINDS = {"offline_download": "下载", "offline_download_transfer": "转存"}
+TASK_STATE_SUCCEEDED = 2
+TASK_TARGET_REGEX = re.compile(r' to \((.+)\)$')  # 任务名形如 "download <url> to (<目标目录>)"
+TASK_STATE_LABELS = {0: "等待中", 1: "进行中", 2: "成功", 3: "取消中", 4: "已取消", 5: "出错",
+                     6: "失败中", 7: "失败", 8: "等待重试", 9: "重试中"}
+
+
+@dataclass
+class TrackedTask:
+    kind: str
+    task_id: str
+    name: str
+    state: int
+    progress: float = 0.0
+    error: str = ""
+
+
+class TaskTracker:
+    """批量轮询 Alist 离线下载/转存任务列表，维护任务状态表，任务结束时合并推送一条通知"""
+
+    def __init__(self):
+        self.application: Application | None = None
+        self.active: dict[str, TrackedTask] = {}  # 未完成任务，键为 "类型:任务ID"
+        self.poll_count = 0
+        self.last_poll: datetime | None = None
+        self._finished_keys: dict[str, set[str]] = {kind: set() for kind in TASK_KINDS}
+        self._baseline: set[str] = set()  # 已完成首次轮询的任务类型（首次只记录历史任务，不推送）
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self, application: Application) -> None:
+        self.application = application
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def wake(self) -> None:
+        """有新任务提交时提前开始下一轮轮询"""
+        if self._task is not None:
+            self._wakeup.set()
+
+    def next_interval(self) -> float:
+        """无活跃任务时低频轮询；活跃任务越多（单次响应越大）轮询间隔越长"""
+        if not self.active:
+            return TASK_POLL_IDLE_SECONDS
+        return min(TASK_POLL_MAX_SECONDS, TASK_POLL_MIN_SECONDS * (1 + len(self.active) // 10))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"轮询离线任务时发生未知错误: {str(e)}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.next_interval())
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _fetch(self, token: str, kind: str, which: str) -> list[dict] | None:
+        try:
+            response = await alist_client.api_request("GET", f"/api/admin/task/{kind}/{which}", token, timeout=30)
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"获取{TASK_KINDS[kind]}任务列表失败: {str(e)}")
+            return None
+        if result.get("code") != 200:
+            logger.error(f"获取{TASK_KINDS[kind]}任务列表失败: {result.get('message', '未知错误')}")
+            return None
+        return result.get("data") or []
+
+    async def poll(self) -> None:
+        token = await token_manager.get()
+        if not token:
+            logger.error("无法获取 Alist token，跳过离线任务轮询")
+            return
+        # 每种任务的未完成/已完成列表各一次批量请求，并发发出
+        queries = [(kind, which) for kind in TASK_KINDS for which in ("undone", "done")]
+        lists = await asyncio.gather(*(self._fetch(token, kind, which) for kind, which in queries))
+        fetched = dict(zip(queries, lists))
+
+        finished: list[TrackedTask] = []
+        failed: list[TrackedTask] = []  # 新出现的失败任务（含首次轮询前失败的历史任务）
+        for kind in TASK_KINDS:
+            undone, done = fetched[(kind, "undone")], fetched[(kind, "done")]
+            if undone is None or done is None:
+                continue  # 本轮数据不完整，保留该类型的原有状态
+            for key in [key for key, task in self.active.items() if task.kind == kind]:
+                del self.active[key]
+            for item in undone:
+                task = self._to_task(kind, item)
+                self.active[f"{kind}:{task.task_id}"] = task
+
+            done_keys = set()
+            for item in done:
+                task = self._to_task(kind, item)
+                key = f"{kind}:{task.task_id}"
+                done_keys.add(key)
+                if key not in self._finished_keys[kind]:
+                    if kind in self._baseline:
+                        finished.append(task)
+                    if task.state != TASK_STATE_SUCCEEDED:
+                        failed.append(task)
+            # 只保留 Alist 仍在返回的已完成任务，避免状态表无限增长
+            self._finished_keys[kind] = done_keys
+            self._baseline.add(kind)
+
+        self.poll_count += 1
+        self.last_poll = datetime.now()
+        if finished:
+            await self._notify(finished)
+        if failed:
+            self._forget_failed(failed)
+
+    def _forget_failed(self, failed: list[TrackedTask]) -> None:
+        """下载失败的磁力从提交索引中移除，之后可以重新提交（仍有同一磁力的任务在进行时保留）"""
+        active_hashes = {extract_info_hash(task.name) for task in self.active.values()}
+        info_hashes = {extract_info_hash(task.name) for task in failed} - active_hashes - {None}
+        if not info_hashes:
+            return
+        try:
+            removed = submission_index.remove(info_hashes)
+        except sqlite3.Error as e:
+            logger.error(f"更新提交索引失败: {str(e)}")
+            return
+        if removed:
+            logger.info(f"已从提交索引移除 {removed} 个下载失败的磁力，可重新提交")
+
+    async def _fetch_offline_downloads(self, token: str) -> list[dict] | None:
+        undone, done = await asyncio.gather(self._fetch(token, "offline_download", "undone"),
+                                            self._fetch(token, "offline_download", "done"))
+        if undone is None or done is None:
+            return None
+        return [*undone, *done]
+
+    async def task_ids(self, token: str) -> set[str] | None:
+        """当前全部离线下载任务的 ID（提交前记录，用于之后区分新加入的任务），获取失败时返回 None"""
+        items = await self._fetch_offline_downloads(token)
+        return None if items is None else {str(item.get("id", "")) for item in items}
+
+    async def queued_info_hashes(self, token: str, known_ids: set[str] | None) -> set[str] | None:
+        """known_ids 之外（即提交后新加入）的离线下载任务的 info-hash；
+        没有提交前的任务 ID 时只统计未完成任务。获取失败时返回 None"""
+        if known_ids is None:
+            items = await self._fetch(token, "offline_download", "undone")
+        else:
+            items = await self._fetch_offline_downloads(token)
+        if items is None:
+            return None
+        return {info_hash for item in items
+                if (known_ids is None or str(item.get("id", "")) not in known_ids)
+                and (info_hash := extract_info_hash(item.get("name") or ""))}
+
+    @staticmethod
+    def _to_task(kind: str, item: dict) -> TrackedTask:
+        return TrackedTask(
+            kind=kind,
+            task_id=str(item.get("id", "")),
+            name=item.get("name") or "",
+            state=int(item.get("state") or 0),
+            progress=float(item.get("progress") or 0),
+            error=item.get("error") or "",
+        )
+
+    @staticmethod
+    def submission_record(task: TrackedTask) -> tuple[str | None, int | None, float] | None:
+        """根据任务名中的磁力 info-hash 查找本机器人的提交记录，不是本机器人提交的任务返回 None"""
+        info_hash = extract_info_hash(task.name)
+        if not info_hash:
+            return None
+        try:
+            return submission_index.lookup(info_hash)
+        except sqlite3.Error:
+            return None
+
+    @classmethod
+    def submitted_code(cls, task: TrackedTask) -> str | None:
+        """提交时记录的番号"""
+        previous = cls.submission_record(task)
+        return previous[0] if previous else None
+
+    @classmethod
+    def display_name(cls, task: TrackedTask) -> str:
+        """优先显示提交时记录的番号，否则显示截断的任务名"""
+        return cls.submitted_code(task) or task.name[:40]
+
+    async def _invalidate_downloads(self, succeeded: list[TrackedTask]) -> None:
+        """新下载落地的子目录在下次增量清理时重新列出。
+        目标目录（下载根目录）本身每次都会重新列出，需要失效的是各番号的下载子目录"""
+        targets = {}
+        for task in succeeded:
+            match = TASK_TARGET_REGEX.search(task.name)
+            targets.setdefault(match.group(1) if match else OFFLINE_DOWNLOAD_DIR, []).append(task)
+        for target in targets:
+            directory_index.invalidate(target)
+
+        token = await token_manager.get()
+        stale = set()
+        for target, tasks in targets.items():
+            for task in tasks:
+                code = self.submitted_code(task)
+                folders = None
+                if code and token:
+                    folders, _ = await find_download_directory(token, target, code)
+                # 找不到对应子目录时整个目标目录树都重新列出
+                stale.update(folders or [target])
+        try:
+            dir_snapshot.invalidate_tree(stale)
+        except sqlite3.Error as e:
+            logger.error(f"更新目录快照失败: {str(e)}")
+
+    async def _notify(self, finished: list[TrackedTask]) -> None:
+        succeeded = [task for task in finished if task.state == TASK_STATE_SUCCEEDED]
+        failed = [task for task in finished if task.state != TASK_STATE_SUCCEEDED]
+        lines = ["📦 离线任务状态更新", "━━━━━━━━━━━━━━━"]
+        for task in (succeeded + failed)[:10]:
+            kind_label = TASK_KINDS[task.kind]
+            if task.state == TASK_STATE_SUCCEEDED:
+                lines.append(f"🟢 {kind_label}完成: {self.display_name(task)}")
+            else:
+                state_label = TASK_STATE_LABELS.get(task.state, str(task.state))
+                lines.append(f"🔴 {kind_label}{state_label}: {self.display_name(task)} | {task.error[:30]}")
+        if len(finished) > 10:
+            lines.append(f"（仅显示前10条，共{len(finished)}条）")
+        lines.append("━━━━━━━━━━━━━━━")
+        lines.append(f"成功: {len(succeeded)} 条 | 失败: {len(failed)} 条 | 进行中: {len(self.active)} 条")
+        text = "\n".join(lines)
+        logger.info(f"离线任务结束: 成功 {len(succeeded)} 条，失败 {len(failed)} 条")
+
+        for chat_id in ALLOWED_USER_IDS:
+            try:
+                await self.application.bot.send_message(chat_id=chat_id, text=text)
+            except TelegramError as e:
+                logger.error(f"推送离线任务通知失败 ({chat_id}): {str(e)}")
+        if succeeded:
+            await self._invalidate_downloads(succeeded)
+            refresh_scheduler.request()
+            if CLEAN_ON_COMPLETE:
+                # 只清理本机器人提交的任务，其他来源的任务可能下载到与本机器人无关的目录
+                for task in succeeded:
+                    previous = self.submission_record(task)
+                    if previous is None:
+                        continue
+                    match = TASK_TARGET_REGEX.search(task.name)
+                    cleanup_scheduler.request(match.group(1) if match else OFFLINE_DOWNLOAD_DIR, previous[0])
+
+
+task_tracker = TaskTracker()
+
+
+# --- 完成后清理调度 ---
+@dataclass
+class CleanupRequest:
+    path: str  # 下载目标目录
+    code: str | None  # 已知番号时只清理该番号对应的子目录
+    requested_at: float
+
+
+def is_within_download_dir(path: str) -> bool:
+    """路径是否为 OFFLINE_DOWNLOAD_DIR 或其子目录"""
+    def normalize(value: str) -> str:
+        return '/' + posixpath.normpath('/' + value.strip().replace('\\', '/')).lstrip('/')
+
+    root, path = normalize(OFFLINE_DOWNLOAD_DIR), normalize(path)
+    return path == root or path.startswith(root.rstrip('/') + '/')
+
+
+class CleanupScheduler:
+    """下载完成后按目录调度清理（延迟合并同一目录的多次请求），并记录积压与延迟指标"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # 与定时全目录清理互斥，避免同时删除同一目录
+        self.pending: dict[tuple[str, str | None], CleanupRequest] = {}
+        self.run_count = 0
+        self.deleted_files = 0
+        self.last_lag: float | None = None  # 最近一次清理距离完成事件的秒数
+        self.max_lag: float = 0.0
+        self._task: asyncio.Task | None = None
+
+    def request(self, path: str, code: str | None = None) -> None:
+        # 关闭自动清理（CLEAN_INTERVAL_MINUTES=0）时完成后清理同样关闭
+        if SIZE_THRESHOLD == 0 or CLEAN_INTERVAL_MINUTES == 0:
+            return
+        if not is_within_download_dir(path):
+            logger.warning(f"忽略下载目录以外的完成后清理请求: {path}")
+            return
+        key = (path, code)
+        if key not in self.pending:
+            self.pending[key] = CleanupRequest(path, code, time.time())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    @property
+    def backlog(self) -> int:
+        return len(self.pending)
+
+    @property
+    def lag(self) -> float:
+        """最早一条待处理请求已等待的秒数"""
+        if not self.pending:
+            return 0.0
+        return time.time() - min(req.requested_at for req in self.pending.values())
+
+    async def _run(self) -> None:
+        while self.pending:
+            oldest = min(req.requested_at for req in self.pending.values())
+            wait = oldest + CLEAN_EVENT_DELAY_SECONDS - time.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            due_before = time.time() - CLEAN_EVENT_DELAY_SECONDS
+            due = [key for key, req in self.pending.items() if req.requested_at <= due_before]
+            for key in due:
+                req = self.pending.pop(key)
+                try:
+                    async with self.lock:
+                        await self._clean(req)
+                except Exception as e:
+                    logger.error(f"完成后清理异常: {req.path} - {str(e)}", exc_info=True)
+                self.last_lag = time.time() - req.requested_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+
+    async def _clean(self, req: CleanupRequest) -> None:
+        token = await token_manager.get()
+        if not token:
+            logger.error("无法获取 Alist token，跳过完成后清理")
+            return
+        targets = None
+        if req.code:
+            targets, _ = await find_download_directory(token, req.path, req.code)
+        if targets:
+            result = await run_cleanup(token, targets)
+            self.deleted_files += result.deleted_files
+            logger.info(f"完成后清理 {', '.join(targets)}: 删除 {result.deleted_files} 个文件, "
+                        f"{result.deleted_dirs} 个空文件夹")
+        else:
+            # 不知道具体子目录时增量清理目标目录（只会重新列出有变化的目录）
+            deleted, msg = await cleanup_small_files(token, req.path, incremental=True)
+            self.deleted_files += deleted
+            logger.info(f"完成后清理 {req.path}: {msg}")
+        self.run_count += 1
+
+    async def stop(self) -> None:
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+cleanup_scheduler = CleanupScheduler()
+
+
 # --- 自动清理定时任务 ---
 async def auto_clean(context: ContextTypes.DEFAULT_TYPE):
     if CLEAN_INTERVAL_MINUTES == 0 or SIZE_THRESHOLD == 0:
@@ -918,7 +3172,8 @@ async def auto_clean(context: ContextTypes.DEFAULT_TYPE):
     processing_msg = await context.bot.send_message(chat_id=chat_id, text="🧹 开始自动清理任务...")
 
     try:
-        deleted_files, msg = await cleanup_small_files(token, BASE_URL, OFFLINE_DOWNLOAD_DIR)
+        async with cleanup_scheduler.lock:
+            deleted_files, msg = await cleanup_small_files(token, OFFLINE_DOWNLOAD_DIR, incremental=True)
         final_text = f"自动清理完成\n{msg}"
         await processing_msg.edit_text(final_text)
     except Exception as e:
@@ -931,21 +3186,86 @@ async def auto_clean(context: ContextTypes.DEFAULT_TYPE):
         await processing_msg.edit_text("\n".join(error_text))
 
 
+@restricted
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE, token: str) -> None:
+    """查看后台组件运行状态"""
+    job_counts = job_queue.store.state_counts()
+    last_poll = task_tracker.last_poll.strftime('%H:%M:%S') if task_tracker.last_poll else "未轮询"
+    last_lag = f"{cleanup_scheduler.last_lag:.0f} 秒" if cleanup_scheduler.last_lag is not None else "无"
+    lines = [
+        "📊 运行状态",
+        "━━━━━━━━━━━━━━━",
+        f"批量任务: 等待 {job_counts.get(JOB_PENDING, 0)} | 处理中 {job_counts.get(JOB_SEARCHING, 0)}",
+        f"离线任务: 进行中 {len(task_tracker.active)} | 最近轮询 {last_poll} | 下次间隔 {task_tracker.next_interval():.0f} 秒",
+        f"完成后清理: 积压 {cleanup_scheduler.backlog} | 当前等待 {cleanup_scheduler.lag:.0f} 秒 | "
+        f"最近延迟 {last_lag} | 最大延迟 {cleanup_scheduler.max_lag:.0f} 秒",
+        f"已执行清理: {cleanup_scheduler.run_count} 次 | 删除文件 {cleanup_scheduler.deleted_files} 个",
+        f"目录快照: {len(dir_snapshot.nodes)} 个目录",
+        f"后台刷新: {refresh_scheduler.refresh_count} 次",
+        f"搜索缓存: {search_cache.stats()}",
+        "━━━━━━━━━━━━━━━",
+        f"搜索镜像（对冲 {mirror_search_for(SEARCH_URL).hedges} 次）:",
+        *[f"• {mirror.describe()}" for mirror in mirror_search_for(SEARCH_URL).mirrors],
+        "上游熔断器:",
+        *([f"• {breaker.describe()}" for client in (alist_client, search_client) for breaker in client.breakers.values()]
+          or ["• 暂无请求记录"]),
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+
+# --- 应用生命周期 ---
+async def post_init(application: Application) -> None:
+    """启动时创建共享连接池"""
+    await alist_client.start()
+    await search_client.start()
+    submission_index.open()
+    dir_snapshot.open()
+    await token_manager.start()
+    await job_queue.start(application)
+    if TASK_TRACKING_ENABLED:
+        task_tracker.start(application)
+
+
+async def post_shutdown(application: Application) -> None:
+    """退出时关闭共享连接池"""
+    await job_queue.stop()
+    await task_tracker.stop()
+    await cleanup_scheduler.stop()
+    await refresh_scheduler.stop()
+    await token_manager.stop()
+    await alist_client.close()
+    await search_client.close()
+    submission_index.close()
+    dir_snapshot.close()
+
+
 # --- 主函数 ---
 def main() -> None:
     """启动机器人"""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # 注册命令处理程序
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("clean", clean_command))
     application.add_handler(CommandHandler("refresh", refresh_command))
+    application.add_handler(CommandHandler("jobs", jobs_command))
+    application.add_handler(CommandHandler("status", status_command))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, process_message))
 
-    # 启动自动清理任务
-    job_queue = application.job_queue
-    job_queue.run_repeating(auto_clean, interval=CLEAN_INTERVAL_MINUTES * 60, first=0)
+    # 启动自动清理任务（启用完成后清理时，定时全目录清理只作为低频兜底）
+    scheduler = application.job_queue
+    if CLEAN_ON_COMPLETE and TASK_TRACKING_ENABLED:
+        sweep_interval = CLEAN_SWEEP_HOURS * 3600
+        scheduler.run_repeating(auto_clean, interval=sweep_interval, first=sweep_interval)
+    else:
+        scheduler.run_repeating(auto_clean, interval=CLEAN_INTERVAL_MINUTES * 60, first=0)
 
     # 启动机器人
     application.run_polling()